@@ -26,6 +26,7 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(os.getcwd()), 'dependencies'))
 from neuron_readExportedGeometry import *
+from neuron_rendering import *
 import matplotlib as mpl
 from mpl_toolkits.mplot3d import Axes3D
 import matplotlib.pyplot as plt
@@ -40,18 +41,18 @@ thoc = '/home/cosmo/marderlab/test/878_043_GM_scaled.hoc'
 def pathplot(hoc, path = 0, fs = 20):
     # Convert given hoc file into a geo object
     print('*Building geo object for {}, please wait...'.format(hoc))
-    geo = demoReadsilent(hoc)
+    geo = demoReadsilent(hoc, cache=True)
     print('*Building heatmap for {}, please wait...'.format(hoc))
 	
     # Find the tip segments and their end locations
     tips, ends = geo.getTips()
    
     # Calculate the path distance to each tip
-    pDF = PathDistanceFinder(geo, geo.soma)
-    pdists = [pDF.distanceTo(seg) for seg in tips]
+    pDF = geo.getPathDistanceFinder(geo.soma)
+    pdists = pDF.distancesTo(tips)
    
     # Calculate the coordinate position of each tip
-    coords = [tips[i].coordAt(ends[i]) for i in range(len(tips))]
+    coords = pDF.coordsAt(tips, ends)
    
     # Build and plot the neuron skeleton (includes axons)
     bpts = []
@@ -62,14 +63,8 @@ def pathplot(hoc, path = 0, fs = 20):
             plt.plot([b[c][0], b[c+1][0]], 
                      [b[c][1], b[c+1][1]], color='k', alpha=1, lw=1.5)
 
-    # Create a list of indices ordered from shortest path to longest
-    pord = list(pdists) # Preserve pdists
-    pind = []
-    for p in pord:
-        maxind = pord.index(max(pord))
-        pind.append(maxind)
-        pord.insert(maxind, -1)
-        pord.remove(pord[maxind+1])
+    # Create a list of indices ordered from longest path to shortest
+    pind = pathOrder(pdists)
 
     # Enumerate the paths leading to each tip in a dictionary
     tipDict = {}
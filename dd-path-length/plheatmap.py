@@ -26,6 +26,7 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(os.getcwd()), 'dependencies'))
 from neuron_readExportedGeometry import *
+from neuron_rendering import *
 import matplotlib.pyplot as plt
 #%matplotlib inline
 
@@ -67,8 +68,8 @@ def pathcompare(hocs, width = 0, height = 0):
     # Calculate colorbar upper limit
     maxDists = []
     for g in geo:
-        f = demoReadsilent(g)
-        pdists = [PathDistanceFinder(f, f.soma).distanceTo(s) for s in f.getTips()[0]]
+        f = demoReadsilent(g, cache=True)
+        pdists = f.getPathDistanceFinder(f.soma).distancesTo(f.getTips()[0])
         maxDists.append(max(pdists))
         vmax = max(maxDists)
 
@@ -87,74 +88,16 @@ def pathplot(hoc, show = True, save = False, fs = 20, vmax = 500):
 
     # Convert given hoc file into a geo object
     print('*Building geo object for {}, please wait...'.format(name))
-    geo = demoReadsilent(hoc)
+    geo = demoReadsilent(hoc, cache=True)
     print('*Building heatmap for {}, please wait...'.format(name))
     	
-    # Find the tip segments and their end locations
-    tips, ends = geo.getTips()
-   
-    # Calculate the path distance to each tip
-    pDF = PathDistanceFinder(geo, geo.soma)
-    pdists = [pDF.distanceTo(seg) for seg in tips]
-   
-    # Calculate the coordinate position of each tip
-    coords = [tips[i].coordAt(ends[i]) for i in range(len(tips))]
-   
-    # Build and plot the neuron skeleton (includes axons)
-    bpts = []
-    for b in geo.branches:
-        bpts.append([[n.x, n.y] for n in b.nodes])
-    for b in bpts:
-        for c in range(len(b)-1):
-            plt.plot([b[c][0], b[c+1][0]], 
-                     [b[c][1], b[c+1][1]], color='k', alpha=0.5)
-        
-    # Set up the path distance colormap with normalized values
-    if show:
-        vmax = max(pdists)
-    tfloats = [float(i)/vmax for i in pdists]
-    cmap = plt.cm.viridis
-    tcolors = cmap(tfloats)
-
-    # Plot and color points at tips by path distance
-    for t, pts in enumerate(coords):
-        plt.plot(pts[0], pts[1], 'o', color=tcolors[t], alpha=0.1,
-                 mec='none', ms=1)
-                 
-    # Plot point at the soma.
-    plt.plot(geo.soma.nodes[0].x, geo.soma.nodes[0].y, 'o',
-             color = 'black', alpha=0.9, mec='none')
-
-    # Create a list of indices ordered from shortest path to longest
-    pord = list(pdists) # Preserve pdists
-    pind = []
-    for p in pord:
-        maxind = pord.index(max(pord))
-        pind.append(maxind)
-        pord.insert(maxind, -1)
-        pord.remove(pord[maxind+1])
-    pind.reverse()
-
-    # Enumerate the paths leading to each tip in a dictionary
-    tipDict = {}
-    for d in range(len(tips)):
-        tipDict[d] = pDF.pathTo(tips[d])
-    
-    # Overlay a tip path skeleton colored by path distance (discludes axons)
-    for path in pind:
-        for seg in tipDict[path]:
-            plt.plot([seg.nodes[0].x, seg.nodes[1].x], 
-                     [seg.nodes[0].y, seg.nodes[1].y], 
-                     color=tcolors[path], alpha=1)
-    
-    # Add colorbar
-    sc = []
-    sc.append(plt.scatter([0,0], [0,0], c=[0., 1.], s=0.1,
-                      vmin=0, vmax=vmax, cmap=cmap))
-    cbar = plt.colorbar(sc[-1])
+    # Draw the skeleton and tip paths colored by path distance, and add
+    # colorbar
+    ax = plt.gca()
+    sc = drawHeatmap(ax, geo, None if show else vmax)
+    cbar = plt.colorbar(sc)
 
     # Add labels
-    ax = plt.gca()
     if show:
         plt.xlabel('Micrometers', fontsize=fs)
         plt.ylabel('Micrometers', fontsize=fs)
@@ -26,10 +26,13 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(os.getcwd()), 'dependencies'))
 from neuron_readExportedGeometry import *
+from neuron_rendering import *
 from rotanimate import *
 import matplotlib as mpl
 from mpl_toolkits.mplot3d import Axes3D
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 import matplotlib.pyplot as plt
+import numpy as np
 
 
 # Testing
@@ -45,6 +48,15 @@ def pathhelp():
 pathhelp()
 
 
+def line3DCollection(segments, colors, linewidths, alpha=None, zorder=2):
+    # Line3DCollection that looks like the equivalent ax.plot lines
+    return Line3DCollection(segments, colors=colors, alpha=alpha,
+                            linewidths=linewidths,
+                            capstyle=plt.rcParams['lines.solid_capstyle'],
+                            joinstyle=plt.rcParams['lines.solid_joinstyle'],
+                            zorder=zorder)
+
+
 # Plot the path heat map in 3D
 def pathplot(hoc, movie='', ms=15, fs=30, lw=2, res=30, invert=True, pkl=''):
 
@@ -52,20 +64,25 @@ def pathplot(hoc, movie='', ms=15, fs=30, lw=2, res=30, invert=True, pkl=''):
     fig = plt.figure()
     ax = fig.gca(projection='3d')
 
+    # Draw artists in zorder instead of sorting collections by depth, so the
+    # tip path overlay and tips stay on top of the skeleton (as they did when
+    # every segment was its own line)
+    ax.computed_zorder = False
+
     # Convert given hoc file into a geo object
     print('*Building geo object for {}, please wait...'.format(hoc))
-    geo = demoReadsilent(hoc)
+    geo = demoReadsilent(hoc, cache=True)
     print('*Building heatmap for {}, please wait...'.format(hoc))
 
     # Find the tip segments and their end locations
     tips, ends = geo.getTips()
    
     # Calculate the path distance to each tip
-    pDF = PathDistanceFinder(geo, geo.soma)
-    pdists = [pDF.distanceTo(seg) for seg in tips]
+    pDF = geo.getPathDistanceFinder(geo.soma)
+    pdists = pDF.distancesTo(tips)
    
     # Calculate the coordinate position of each tip
-    coords = [tips[i].coordAt(ends[i]) for i in range(len(tips))]
+    coords = pDF.coordsAt(tips, ends)
     
     # Establish color scheme
     ic = 'black'
@@ -80,16 +97,14 @@ def pathplot(hoc, movie='', ms=15, fs=30, lw=2, res=30, invert=True, pkl=''):
         ax.tick_params(axis='x', colors='white')
         ax.tick_params(axis='y', colors='white')
 
-    # Build and plot the neuron skeleton (includes axons)
-    bpts = []
-    for b in geo.branches:
-        bpts.append([[n.x, n.y, n.z] for n in b.nodes])
-    for b in bpts:
-        for c in range(len(b)-1):
-            ax.plot([b[c][0], b[c+1][0]], 
-                    [b[c][1], b[c+1][1]],
-                    [b[c][2], b[c+1][2]], 
-                    color=ic, alpha=0.5, linewidth=lw)
+    # Build and plot the neuron skeleton (includes axons) as one collection
+    # of (N,2,3) node-pair segments
+    bpts = [np.array([[n.x, n.y, n.z] for n in b.nodes]).reshape(-1, 3)
+            for b in geo.branches]
+    bsegs = np.concatenate([np.stack((b[:-1], b[1:]), axis=1) for b in bpts])
+    ax.add_collection3d(line3DCollection(bsegs, ic, lw, alpha=0.5))
+    skel = bsegs.reshape(-1, 3)
+    ax.auto_scale_xyz(skel[:, 0], skel[:, 1], skel[:, 2])
         
     # Set up the path distance color map with normalized values
     vmax = max(pdists)
@@ -98,38 +113,39 @@ def pathplot(hoc, movie='', ms=15, fs=30, lw=2, res=30, invert=True, pkl=''):
     tcolors = cmap(tfloats)
 
     # Plot points at tips and color by path distance
-    for t, pts in enumerate(coords):
-        ax.scatter(pts[0], pts[1], pts[2], c=tcolors[t],
-                   edgecolors='face', alpha=0.9)
+    tpts = np.array(coords).reshape(-1, 3)
+    ax.scatter(tpts[:, 0], tpts[:, 1], tpts[:, 2], c=tcolors,
+               edgecolors='face', alpha=0.9, depthshade=False, zorder=4)
     
     # Plot point at the soma.
     ax.scatter(geo.soma.nodes[0].x, geo.soma.nodes[0].y, geo.soma.nodes[0].z,
-               c = ic, s = 100, edgecolors='face')
+               c = ic, s = 100, edgecolors='face', zorder=4)
 
     # Create a list of indices ordered from shortest path to longest
-    pord = list(pdists) # Preserve pdists
-    pind = []
-    for p in pord:
-        maxind = pord.index(max(pord))
-        pind.append(maxind)
-        pord.insert(maxind, -1)
-        pord.remove(pord[maxind+1])
-    pind.reverse()
-
-    # Enumerate the paths leading to each tip in a dictionary
-    tipDict = {}
-    for d in range(len(tips)):
-        tipDict[d] = pDF.pathTo(tips[d])
-    
-    # Overlay a tip path skeleton colored by path distance (discludes axons)
-    for path in pind:
-        if path==pind[0]: lw+=0.1
-        else:lw+=0.001
-        for seg in tipDict[path]:
-            ax.plot([seg.nodes[0].x, seg.nodes[1].x], 
-                    [seg.nodes[0].y, seg.nodes[1].y],
-                    [seg.nodes[0].z, seg.nodes[1].z], 
-                    color=tcolors[path], alpha=1, linewidth=lw)
+    pind = pathOrder(pdists)[::-1]
+
+    # Overlay a tip path skeleton colored by path distance (discludes axons).
+    # Each segment is drawn once, in the color of the longest tip path through
+    # it, in the same order as the paths; each path is slightly wider than the
+    # one before so longer paths stay on top
+    tipDists, tipInds = geo.maxTipPathDistances(tips)
+    ranks = np.empty(len(pind), dtype=int)
+    ranks[pind] = np.arange(len(pind))
+    onPath = np.flatnonzero(tipInds >= 0)
+    onPath = onPath[np.argsort(ranks[tipInds[onPath]], kind='stable')]
+    if len(onPath):
+        plws = np.cumsum([lw, 0.1] + [0.001] * (len(pind) - 1))[1:]
+        lw = plws[-1]
+        psegs = np.array([[[geo.segments[i].nodes[0].x,
+                            geo.segments[i].nodes[0].y,
+                            geo.segments[i].nodes[0].z],
+                           [geo.segments[i].nodes[1].x,
+                            geo.segments[i].nodes[1].y,
+                            geo.segments[i].nodes[1].z]]
+                          for i in onPath]).reshape(-1, 2, 3)
+        ax.add_collection3d(line3DCollection(psegs, tcolors[tipInds[onPath]],
+                                             plws[ranks[tipInds[onPath]]],
+                                             alpha=1, zorder=3))
     print('*The maximum linewidth is {}'.format(round(lw, 4)))
     print(lw)
     
@@ -162,17 +178,10 @@ def pathplot(hoc, movie='', ms=15, fs=30, lw=2, res=30, invert=True, pkl=''):
     if movie != '':
 		
 		# Remove whitespace around skeleton for visual appeal
-        xpts = []
-        ypts = []
-        zpts = []
-        for b in bpts:
-            for c in range(len(b)-1):
-                xpts.append(b[c][0])
-                ypts.append(b[c][1])
-                zpts.append(b[c][2])
-        ax.set_xlim(min(xpts),max(xpts))
-        ax.set_ylim(min(ypts),max(ypts))
-        ax.set_zlim(min(zpts),max(zpts))
+        spts = bsegs[:, 0]
+        ax.set_xlim(spts[:, 0].min(), spts[:, 0].max())
+        ax.set_ylim(spts[:, 1].min(), spts[:, 1].max())
+        ax.set_zlim(spts[:, 2].min(), spts[:, 2].max())
         
         # Remove axes for visual appeal.
         plt.axis('off')
@@ -9,22 +9,32 @@ _usageStr=\
 
 
 import os
-from scipy import special, mean, std
-from collections import deque
+from scipy import special, sparse, mean, std
+from collections import deque, OrderedDict
+from collections.abc import MutableSet
+from heapq import heappush, heappop
 import matplotlib.pyplot as pyplot
 from math import log, sqrt, atan, isnan, pi, acos
-from bisect import bisect_left
+from bisect import bisect_left, bisect_right
 import numpy as np
 
 """
 Geometry class public methods: (self is always first argument)
  setFileName(_fileName)
  numCompartments()
+ getPathDistanceFinder()
+ getGeodesicIndex()
+ getSegmentGraph()
  readGeometry()  pure virtual
  displaySummary()
  findBranches()
  checkConnectivity()
+ findLoops()
+ breakLoops()
  shollAnalysis()
+ shollIntersections()
+ subtreeAggregates()
+ totalCableLength()
 """
 
 terminalColors = {
@@ -70,6 +80,77 @@ def cumsum(values, start=0.0, yieldStart=True):
     yield start
 
 
+def frustumGeometry(x0, y0, z0, r0, x1, y1, z1, r1, minor0=None,
+                    minor1=None):
+  """
+  Compute the geometry of many frustums (two-node compartments) at once. Each
+  argument is a numpy array describing the end nodes: r0 and r1 are the
+  radii (semi-major axes), minor0 and minor1 are the semi-minor axes of
+  elliptical cross sections (by default the cross sections are circular).
+  return (lengths, surfaceAreas, volumes, centroids)
+    lengths in um, surfaceAreas in mm^2, volumes in mm^3, and centroids as an
+    (N, 3) array in um (the same units and formulas as TwoNodeCompartment
+    .length, .surfaceArea, .volume and .centroid). The centroid of a
+    compartment with zero length is its first node.
+  """
+  if minor0 is None:
+    minor0 = r0
+  if minor1 is None:
+    minor1 = r1
+  lengths = np.sqrt((x1 - x0)**2 + (y1 - y0)**2 + (z1 - z0)**2)
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    # the cross sections at the two ends must have the same shape
+    ratio0 = minor0 / r0
+    ratio1 = minor1 / r1
+    ratio0 = np.where(np.isnan(ratio0), ratio1, ratio0)
+    ratio1 = np.where(np.isnan(ratio1), ratio0, ratio1)
+    if np.isnan(ratio0).any():
+      raise IOError('Degenerate (zero radius) compartment')
+    if (ratio0 != ratio1).any():
+      raise IOError("Don't have formula for arbitrary eliptical frustrum")
+    
+    coneFactor = np.where(minor0 == minor1, 1.0,
+                          np.sqrt(1 + ((minor0 - minor1) / lengths)**2))
+    angleFactor = np.where(ratio0 == 1.0, pi,
+                           2.0 * special.ellipe(np.sqrt(1.0 - ratio0 * ratio0)
+                                                / coneFactor))
+    areas = coneFactor * angleFactor * lengths * (r0 + r1)
+  # compartments with zero length are disks with holes
+  disks = (lengths == 0) & (minor0 != minor1)
+  areas = np.where(disks, pi * np.abs(r0 * minor0 - r1 * minor1), areas)
+
+  volumes = 1.0e-9 * ((pi / 3.0) * lengths *
+    (r0 * minor0 + r1 * minor1 + 0.5 * (r0 * minor1 + r1 * minor0)))
+  
+  # centroids are weighted toward the thicker end
+  weightedLength = 0.5 * pi * lengths * lengths * \
+    ((r0 * minor0 + r0 * minor1 + r1 * minor0) / 6.0 + 0.5 * r1 * minor1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    ratio1 = weightedLength / (1.0e9 * volumes) / lengths
+  ratio1 = np.where(lengths == 0, 0.0, ratio1)
+  ratio0 = 1.0 - ratio1
+  centroids = np.stack((x0 * ratio0 + x1 * ratio1, y0 * ratio0 + y1 * ratio1,
+                        z0 * ratio0 + z1 * ratio1), axis=-1)
+
+  return lengths, 1.0e-6 * areas, volumes, centroids
+
+
+def setCompartmentGeometry(compartments, lengths, surfaceAreas, volumes,
+                           centroids):
+  """
+  Store geometry computed by frustumGeometry() in compartments, so that their
+  .length, .surfaceArea, .volume and .centroid don't compute it again
+  """
+  for comp, length, area, volume, centroid in zip(
+      compartments, lengths.tolist(), surfaceAreas.tolist(), volumes.tolist(),
+      centroids.tolist()):
+    comp._length = length
+    comp._surfaceArea = area
+    comp._volume = volume
+    comp._centroid = tuple(centroid)
+
+
 """
 class PathDistanceFinder
 Finds network distances from one segment/branch at specified position
@@ -81,9 +162,31 @@ Can report tortuosity of optimal path via
   .tortuosityTo()
 Can compute electrotonic lengths from a list of voltages via
   .getElectrotonicLengths()
+Can report distances, tortuosities and coordinates for many segments at once
+(as numpy arrays) via
+  .distancesTo(), .tortuositiesTo(), .coordsAt()
+Can report which of many segments has the largest value among those whose
+optimal path passes through each segment via
+  .pathMaxima()
+Distances are found over the "ports" of the network: the positions in each
+segment where it connects to neighbors, plus the start position. With
+engine='auto', a single depth-first traversal is used if the network is a
+tree, falling back to Dijkstra's algorithm if it has loops (.engine is then
+'tree' or 'dijkstra'). engine='dijkstra' always uses Dijkstra's algorithm,
+and engine='legacy' selects the original label-correcting search (kept for
+comparison in neuron_benchmarks.py).
+Branch orders (.branchOrder()) are counted along the shortest path to each
+segment (the path to its closest port). In a network with loops, the legacy
+search can report the order along a different path instead: it keeps the
+order of whichever non-dominated path to the segment it relaxed last, which
+depends on the order it pops segments from a set. Distances and paths are
+the same for every engine, and branch orders are too if the network is a
+tree; use engine='legacy' to reproduce the old branch orders of looped
+networks.
 """
 class PathDistanceFinder(object):
-  def __init__(self, geometry, segment, pos=0.5, warnLoops=False):
+  def __init__(self, geometry, segment, pos=0.5, warnLoops=False,
+               engine='auto'):
     self.geometry = geometry
     if type(segment) == int:
       segment = geometry.segments[segment]
@@ -100,31 +203,41 @@ class PathDistanceFinder(object):
     self.startSegment = segment
     self.startPos = pos
     self.startCoord = segment.coordAt(pos)
-    self.distances, self.branchOrders = self._computeDistances()
+    self.engine = engine
+    self._nodeLocations = None
+    if engine == 'auto':
+      # most networks are trees, so try the fast traversal first
+      self._setPorts()
+      self.branchOrders = self._computeTreeDistances()
+      if self.branchOrders is None:
+        self.branchOrders = self._computeDistances()
+        self.engine = 'dijkstra'
+      else:
+        self.engine = 'tree'
+    elif engine == 'dijkstra':
+      self._setPorts()
+      self.branchOrders = self._computeDistances()
+    elif engine == 'legacy':
+      self.branchOrders = self._portsFromLegacy(
+        *self._computeDistancesLegacy())
+    else:
+      raise ValueError('Unknown PathDistanceFinder engine: %s' % engine)
     
   
   def distanceTo(self, segment, pos=0.5):
     # return distance to specified segment at the specified location
-    if type(segment) == int:
-      segment = self.network[segment]
-    
-    if segment not in self.distances:
-      raise KeyError('%s is not reachable from the network' % segment.name)
-
-    return min(baseD + segment.length * abs(pos - startPos) for
-               baseD, startPos, pathDesc, path in self.distances[segment])
+    port, distance = self._bestPort(segment, pos)
+    return distance
   
   def pathTo(self, segment, pos=0.5):
     # return optimal path to specified segment at specified location
-    return min(((baseD + segment.length * abs(pos - startPos), path) for
-               baseD, startPos, pathDesc, path in self.distances[segment]),
-               key=lambda x:x[0])[1]
+    port, distance = self._bestPort(segment, pos)
+    return self._portPath(port)[1]
   
   def pathDescriptionTo(self, segment, pos=0.5):
     # return optimal path to specified segment at specified location
-    return min(((baseD + segment.length * abs(pos - startPos), pathDesc) for
-               baseD, startPos, pathDesc, path in self.distances[segment]),
-               key=lambda x:x[0])[1]
+    port, distance = self._bestPort(segment, pos)
+    return self._portPath(port)[0]
   
   def tortuosityTo(self, segment, pos=0.5):
     stopCoord = segment.coordAt(pos)
@@ -140,6 +253,123 @@ class PathDistanceFinder(object):
     return tortuosity
   
   
+  def distancesTo(self, segments, positions=0.5):
+    # return array of distances to each of segments at the specified
+    #  locations (positions may be one location, or one per segment)
+    segInds, positions = self._segmentIndices(segments, positions)
+    if not len(segInds):
+      return np.zeros(0)
+    # gather every port of every requested segment, then take the minimum for
+    #  each segment
+    starts = self._portOffsets[segInds]
+    counts = self._portOffsets[segInds + 1] - starts
+    if (counts == 0).any():
+      segment = self._segments[segInds[counts.argmin()]]
+      raise KeyError('%s is not reachable from the network' % segment.name)
+    groupStarts = np.cumsum(counts) - counts
+    queryInds = np.repeat(np.arange(len(segInds)), counts)
+    ports = np.arange(counts.sum()) + np.repeat(starts - groupStarts, counts)
+    distances = np.minimum.reduceat(
+      self._portDistances[ports] + self._segmentLengths[segInds][queryInds]
+      * np.abs(positions[queryInds] - self._portLocations[ports]),
+      groupStarts)
+    if (distances == np.inf).any():
+      segment = self._segments[segInds[distances.argmax()]]
+      raise KeyError('%s is not reachable from the network' % segment.name)
+    return distances
+  
+  
+  def coordsAt(self, segments, positions=0.5):
+    # return (numSegments x 3) array of coordinates of each of segments at the
+    #  specified locations (positions may be one location, or one per segment)
+    segInds, positions = self._segmentIndices(segments, positions)
+    if self._nodeLocations is None:
+      self._setNodeArrays()
+    nodeLocations, nodeCoords = self._nodeLocations, self._nodeCoords
+    # vectorized bisect_left of each position into its segment's locations
+    lows = self._nodeLocationOffsets[segInds]
+    highs = self._nodeLocationOffsets[segInds + 1]
+    ends = highs.copy()
+    active = lows < highs
+    while active.any():
+      mids = (lows + highs) // 2
+      below = active & \
+        (nodeLocations[np.minimum(mids, len(nodeLocations) - 1)] < positions)
+      lows = np.where(below, mids + 1, lows)
+      highs = np.where(active & ~below, mids, highs)
+      active = lows < highs
+    if (lows == ends).any():
+      raise ValueError('Requested locations must be between 0.0 and 1.0')
+    nodeInds = self._nodeOffsets[segInds] + lows \
+               - self._nodeLocationOffsets[segInds]
+    # interpolate between nodes, unless exactly at a node
+    atNode = nodeLocations[lows] == positions
+    with np.errstate(divide='ignore', invalid='ignore'):
+      cN0 = (nodeLocations[lows] - positions) / \
+            (nodeLocations[lows] - nodeLocations[lows - 1])
+    cN1 = 1.0 - cN0
+    return np.where(atNode[:, None], nodeCoords[nodeInds],
+                    cN0[:, None] * nodeCoords[nodeInds - 1]
+                    + cN1[:, None] * nodeCoords[nodeInds])
+  
+  
+  def tortuositiesTo(self, segments, positions=0.5):
+    # return array of tortuosities of optimal paths to each of segments at the
+    #  specified locations (positions may be one location, or one per segment)
+    pathDs = self.distancesTo(segments, positions)
+    deltas = self.coordsAt(segments, positions) - self.startCoord
+    euclideanDs = np.sqrt(deltas[:, 0]**2 + deltas[:, 1]**2 + deltas[:, 2]**2)
+    tortuosities = pathDs / euclideanDs
+    if (tortuosities < 1.0).any():
+      ind = np.flatnonzero(tortuosities < 1.0)[0]
+      segment = segments[ind]
+      if type(segment) == int:
+        segment = self.network[segment]
+      pos = np.broadcast_to(positions, tortuosities.shape)[ind]
+      warn('Tortuosity < 1',
+           self.pathDescriptionTo(segment, pos))
+      raise RuntimeError('Path to %s at %g has tortuosity < 1'
+                         % (segment.name, pos))
+    return tortuosities
+  
+  
+  def pathMaxima(self, segments, values, positions=0.5):
+    # for every segment in self.network, return the index of the one of
+    #  segments (at the specified locations) with the largest value whose
+    #  optimal path passes through it (-1 if no path does). Ties go to the
+    #  earliest of segments.
+    # Visiting segments from largest value down, each path only has to be
+    #  followed until it meets one that was already followed, so every port
+    #  is visited at most once.
+    segInds, positions = self._segmentIndices(segments, positions)
+    order = np.argsort(-np.asarray(values, dtype=float), kind='stable')
+    owners = np.full(len(self._segments), -1, dtype=int)
+    if self._portPaths is not None:
+      # legacy engine: no predecessors, so walk each stored path
+      for ind in order:
+        for segment in self.pathTo(self._segments[segInds[ind]],
+                                   positions[ind]):
+          segInd = self._segmentIndex[segment]
+          if owners[segInd] < 0:
+            owners[segInd] = ind
+    else:
+      portSegments = self._portSegments.tolist()
+      predecessors = self._predecessors.tolist()
+      visited = [False] * len(predecessors)
+      for ind in order:
+        port = self._bestPort(self._segments[segInds[ind]], positions[ind])[0]
+        while port >= 0 and not visited[port]:
+          visited[port] = True
+          segInd = portSegments[port]
+          if owners[segInd] < 0:
+            owners[segInd] = ind
+          port = predecessors[port]
+    segmentIndex = self._segmentIndex
+    return np.array([owners[segmentIndex[segment]]
+                     if segment in segmentIndex else -1
+                     for segment in self.network], dtype=int)
+  
+  
   def branchOrder(self, segment):
     return self.branchOrders[segment]
   
@@ -176,11 +406,315 @@ class PathDistanceFinder(object):
     return eLength
       
   
+  def _bestPort(self, segment, pos):
+    # return (port, distance) of the port that gives the shortest path to
+    # specified segment at the specified location
+    if type(segment) == int:
+      segment = self.network[segment]
+    segInd = self._segmentIndex.get(segment)
+    if segInd is None:
+      raise KeyError('%s is not reachable from the network' % segment.name)
+    start, stop = self._portOffsets[segInd], self._portOffsets[segInd + 1]
+    distances = self._portDistances[start:stop] + self._segmentLengths[segInd] \
+                * np.abs(pos - self._portLocations[start:stop])
+    if not distances.size or distances.min() == np.inf:
+      raise KeyError('%s is not reachable from the network' % segment.name)
+    best = distances.argmin()
+    return start + best, float(distances[best])
+  
+  
+  def _segmentIndices(self, segments, positions):
+    # return arrays of indices to self._segments, and of positions, for
+    #  segments (objects or indices to network)
+    segInds = np.empty(len(segments), dtype=int)
+    for ind, segment in enumerate(segments):
+      if type(segment) == int:
+        segment = self.network[segment]
+      segInd = self._segmentIndex.get(segment)
+      if segInd is None:
+        raise KeyError('%s is not reachable from the network' % segment.name)
+      segInds[ind] = segInd
+    positions = np.broadcast_to(np.asarray(positions, dtype=float),
+                                segInds.shape)
+    return segInds, positions
+  
+  
+  def _setNodeArrays(self):
+    # store node locations and coordinates of every segment in flat arrays
+    nodeLocations, nodeCoords = [], []
+    nodeLocationOffsets, nodeOffsets = [0], [0]
+    for segment in self._segments:
+      if not segment.nodeLocations:
+        segment._setNodeLocations()
+      nodeLocations.extend(segment.nodeLocations)
+      nodeCoords.extend((n.x, n.y, n.z) for n in segment.nodes)
+      nodeLocationOffsets.append(len(nodeLocations))
+      nodeOffsets.append(len(nodeCoords))
+    self._nodeLocations = np.array(nodeLocations, dtype=float)
+    self._nodeCoords = np.array(nodeCoords, dtype=float).reshape(-1, 3)
+    self._nodeLocationOffsets = np.array(nodeLocationOffsets)
+    self._nodeOffsets = np.array(nodeOffsets)
+  
+  
+  def _setPorts(self):
+    # Segments are numbered, and each segment has a port (numbered
+    #  consecutively within the segment) for every distinct location where it
+    #  connects to neighbors, plus one for startPos in the start segment.
+    # Moving between ports of a segment costs segment.length * |change in
+    #  location|, moving to a connected port of a neighbor is free.
+    segments = list(self.network)
+    segmentIndex = {segment : ind for ind, segment in enumerate(segments)}
+    startInd = segmentIndex[self.startSegment]
+    portOffsets = [0]
+    portLocations = []
+    portSegments = []
+    # for each segment, dict from location to port
+    segmentPorts = []
+    segInd = 0
+    while segInd < len(segments):
+      segment = segments[segInd]
+      locations = {loc[0] for loc in segment.neighborLocations}
+      if segInd == startInd:
+        locations.add(self.startPos)
+      locations = sorted(locations)
+      numPorts = len(portLocations)
+      segmentPorts.append({location : numPorts + ind
+                           for ind, location in enumerate(locations)})
+      portLocations.extend(locations)
+      portSegments.extend([segInd] * len(locations))
+      portOffsets.append(len(portLocations))
+      for neighbor in segment.neighbors:
+        # neighbors should all be in the network, but don't lose any that aren't
+        if neighbor not in segmentIndex:
+          segmentIndex[neighbor] = len(segments)
+          segments.append(neighbor)
+      segInd += 1
+    
+    # adjacency array of connections between ports of neighboring segments
+    portNeighbors = [[] for port in range(len(portLocations))]
+    for segment, ports in zip(segments, segmentPorts):
+      for neighbor, (connectLoc, nConnectLoc, node) \
+          in zip(segment.neighbors, segment.neighborLocations):
+        portNeighbors[ports[connectLoc]].append(
+          segmentPorts[segmentIndex[neighbor]][nConnectLoc])
+    
+    self._segments = segments
+    self._segmentIndex = segmentIndex
+    self._segmentLengths = [segment.length for segment in segments]
+    self._branchOrderIncs = [0 if len(segment.neighbors) <= 2 else 1
+                             for segment in segments]
+    self._portOffsets = portOffsets
+    self._portLocations = portLocations
+    self._portSegments = portSegments
+    self._portNeighbors = portNeighbors
+    self._startPort = segmentPorts[startInd][self.startPos]
+  
+  
+  def _computeTreeDistances(self):
+    # if the network is a tree, find path distance from start to rest of
+    #  neuron with one depth-first traversal, accumulating distances along the
+    #  way. Return None if a loop is found.
+    portOffsets, portLocations = self._portOffsets, self._portLocations
+    portSegments, portNeighbors = self._portSegments, self._portNeighbors
+    lengths, branchOrderIncs = self._segmentLengths, self._branchOrderIncs
+    
+    inf = float('inf')
+    numPorts = len(portLocations)
+    portDistances = [inf] * numPorts
+    predecessors = [-1] * numPorts
+    # ports that are connected to each other are numbered as one junction
+    junctions = [-1] * numPorts
+    numJunctions = 0
+    branchOrders = [None] * len(self._segments)
+    
+    startPort = self._startPort
+    portDistances[startPort] = 0.0
+    branchOrders[portSegments[startPort]] = 0
+    stack = [startPort]
+    while stack:
+      port = stack.pop()
+      currentD = portDistances[port]
+      segInd = portSegments[port]
+      if port == startPort or portSegments[predecessors[port]] != segInd:
+        # entered the segment at this port, reach its other ports from here
+        location, length = portLocations[port], lengths[segInd]
+        for nPort in range(portOffsets[segInd], portOffsets[segInd + 1]):
+          if nPort == port:
+            continue
+          elif portDistances[nPort] < inf:
+            # segment was entered twice, so there's a loop
+            return None
+          portDistances[nPort] = currentD + \
+                                 length * abs(location - portLocations[nPort])
+          predecessors[nPort] = port
+          stack.append(nPort)
+      
+      # cross connections to neighboring segments
+      if not portNeighbors[port]:
+        continue
+      if junctions[port] < 0:
+        junctions[port] = numJunctions
+        numJunctions += 1
+      junction = junctions[port]
+      order = branchOrders[segInd]
+      nOrder = order + (branchOrderIncs[segInd] if order > 0 else 1)
+      for nPort in portNeighbors[port]:
+        if portDistances[nPort] < inf:
+          if junctions[nPort] != junction:
+            # reached from somewhere other than this junction: loop
+            return None
+          continue
+        portDistances[nPort] = currentD
+        predecessors[nPort] = port
+        junctions[nPort] = junction
+        branchOrders[portSegments[nPort]] = nOrder
+        stack.append(nPort)
+    
+    return self._storeDistances(portDistances, predecessors, branchOrders)
+  
+  
   def _computeDistances(self):
     # use Dijkstra's algorithm to find path distance from start to rest of
     # neuron.
     # Keep track of effect of startPos (starting position in startSegment)
     # Also keep track of effect of pos of each final segment
+    portOffsets, portLocations = self._portOffsets, self._portLocations
+    portSegments, portNeighbors = self._portSegments, self._portNeighbors
+    lengths, branchOrderIncs = self._segmentLengths, self._branchOrderIncs
+    
+    inf = float('inf')
+    numPorts = len(portLocations)
+    portDistances = [inf] * numPorts
+    # the port that each port was reached from, paths are rebuilt from these
+    #  on request by _portPath()
+    predecessors = [-1] * numPorts
+    settled = [False] * numPorts
+    branchOrders = [None] * len(self._segments)
+    
+    startPort = self._startPort
+    portDistances[startPort] = 0.0
+    heap = [(0.0, startPort)]
+    while heap:
+      currentD, port = heappop(heap)
+      if settled[port]:
+        continue
+      settled[port] = True
+      segInd = portSegments[port]
+      if branchOrders[segInd] is None:
+        # this is the closest port of the segment, so it was reached from a
+        #  neighbor that already has a branch order. Taking the order along
+        #  this shortest path differs from the legacy search on loops (see
+        #  class description)
+        if port == startPort:
+          branchOrders[segInd] = 0
+        else:
+          predInd = portSegments[predecessors[port]]
+          predOrder = branchOrders[predInd]
+          branchOrders[segInd] = predOrder + \
+            (branchOrderIncs[predInd] if predOrder > 0 else 1)
+      
+      # move to the other ports of this segment
+      location, length = portLocations[port], lengths[segInd]
+      for nPort in range(portOffsets[segInd], portOffsets[segInd + 1]):
+        pathD = currentD + length * abs(location - portLocations[nPort])
+        if pathD < portDistances[nPort]:
+          portDistances[nPort] = pathD
+          predecessors[nPort] = port
+          heappush(heap, (pathD, nPort))
+      
+      # cross connections to neighboring segments
+      for nPort in portNeighbors[port]:
+        if currentD < portDistances[nPort]:
+          portDistances[nPort] = currentD
+          predecessors[nPort] = port
+          heappush(heap, (currentD, nPort))
+    
+    return self._storeDistances(portDistances, predecessors, branchOrders)
+  
+  
+  def _storeDistances(self, portDistances, predecessors, branchOrders):
+    # store port distances and predecessors as arrays, and return dict of
+    #  branch orders
+    segments = self._segments
+    portOffsets = self._portOffsets
+    self._segmentLengths = np.array(self._segmentLengths, dtype=float)
+    self._portOffsets = np.array(portOffsets)
+    self._portLocations = np.array(self._portLocations)
+    self._portSegments = np.array(self._portSegments, dtype=int)
+    self._portDistances = np.array(portDistances)
+    self._predecessors = np.array(predecessors, dtype=int)
+    self._portPaths = None
+    # only needed while computing distances
+    self._portNeighbors = None
+    self._branchOrderIncs = None
+    
+    if self.warnLoops:
+      # a segment is part of a loop if more than one of its ports is most
+      #  efficiently reached from a neighbor
+      portSegments = self._portSegments
+      for segInd, segment in enumerate(segments):
+        entries = [port for port in range(portOffsets[segInd],
+                                          portOffsets[segInd + 1])
+                   if predecessors[port] >= 0 and
+                   portSegments[predecessors[port]] != segInd]
+        if len(entries) > 1:
+          warn('%d efficient paths to %s.' % (len(entries), segment.name))
+          for port in entries:
+            print(self._portPath(port)[0])
+    
+    return { segment : order for segment, order in zip(segments, branchOrders)
+             if order is not None }
+  
+  
+  def _portPath(self, port):
+    # return (path description, list of segments in path) for the shortest
+    #  path to port, by following predecessors back to the start
+    if self._portPaths is not None:
+      return self._portPaths[port]
+    segments, locations = self._segments, self._portLocations
+    portSegments, predecessors = self._portSegments, self._predecessors
+    path, pathDesc = [], []
+    pred = predecessors[port]
+    while pred >= 0:
+      if portSegments[pred] != portSegments[port]:
+        # crossed a connection from pred's segment into port's segment
+        segment = segments[portSegments[port]]
+        path.append(segment)
+        pathDesc.append('->(%.1f)->' % locations[pred] + segment.name
+                        + '(%.1f)' % locations[port])
+      port, pred = pred, predecessors[pred]
+    path.append(self.startSegment)
+    pathDesc.append(self.startSegment.name + '(%.1f)' % self.startPos)
+    return ''.join(reversed(pathDesc)), path[::-1]
+  
+  
+  def _portsFromLegacy(self, distances, branchOrders):
+    # store results of _computeDistancesLegacy as ports: one for every
+    #  efficient path to each segment
+    self._segments = list(distances.keys())
+    self._segmentIndex = {segment : ind for ind, segment
+                          in enumerate(self._segments)}
+    self._segmentLengths = np.array([segment.length
+                                     for segment in self._segments])
+    portOffsets = [0]
+    portLocations, portDistances, self._portPaths = [], [], []
+    for segment in self._segments:
+      for baseD, startPos, pathDesc, path in distances[segment]:
+        portLocations.append(startPos)
+        portDistances.append(baseD)
+        self._portPaths.append((pathDesc, path))
+      portOffsets.append(len(portLocations))
+    self._portOffsets = np.array(portOffsets)
+    self._portLocations = np.array(portLocations)
+    self._portDistances = np.array(portDistances)
+    return branchOrders
+  
+  
+  def _computeDistancesLegacy(self):
+    # original search for path distance from start to rest of neuron:
+    # segments are revisited in arbitrary order until no path improves.
+    # Keep track of effect of startPos (starting position in startSegment)
+    # Also keep track of effect of pos of each final segment
     segment, startPos = self.startSegment, self.startPos
     # distances is a dict object, with segments as keys
     # the values are a list of paths, each path described by a tuple
@@ -249,6 +783,457 @@ class PathDistanceFinder(object):
 
 
 
+"""
+class GeodesicIndex
+Answers path distance queries between any two points of a loop-free
+geometry's segments in constant time, via
+  .distance(segmentA, posA, segmentB, posB)
+  .distances(segmentsA, positionsA, segmentsB, positionsB)
+  .distanceMatrix(segments, positions)
+  .tipDistanceMatrix()
+The neuron is stored as a tree rooted at the soma, with a node at both ends
+of every segment and at each location where it connects to a neighbor. The
+lowest common ancestor (LCA) of two nodes is found from an Euler tour of the
+tree with a sparse table of range minima.
+"""
+class GeodesicIndex(object):
+  def __init__(self, geometry):
+    self.geometry = geometry
+    pDF = geometry.getPathDistanceFinder(geometry.soma)
+    if pDF.engine != 'tree':
+      raise ValueError('GeodesicIndex requires a loop-free geometry')
+    self._buildTree(pDF)
+    self._buildLCA()
+  
+  
+  def distance(self, segmentA, posA, segmentB, posB):
+    # return path distance between segmentA at posA and segmentB at posB
+    return float(self.distances([segmentA], posA, [segmentB], posB)[0])
+  
+  
+  def distances(self, segmentsA, positionsA, segmentsB, positionsB):
+    # return array of path distances between corresponding elements of
+    #  segmentsA at positionsA and segmentsB at positionsB
+    nodesA, rootDsA = self._locatePoints(segmentsA, positionsA)
+    nodesB, rootDsB = self._locatePoints(segmentsB, positionsB)
+    return self._pointDistances(nodesA, rootDsA, nodesB, rootDsB)
+  
+  
+  def distanceMatrix(self, segments, positions=0.5):
+    # return (numSegments x numSegments) array of path distances between each
+    #  pair of segments at positions
+    nodes, rootDs = self._locatePoints(segments, positions)
+    matrix = np.empty((len(nodes), len(nodes)))
+    # work in blocks of rows to limit the size of temporary arrays
+    blockRows = max(1, (1 << 20) // max(1, len(nodes)))
+    for start in range(0, len(nodes), blockRows):
+      stop = start + blockRows
+      matrix[start:stop] = self._pointDistances(
+        nodes[start:stop, None], rootDs[start:stop, None],
+        nodes[None, :], rootDs[None, :])
+    return matrix
+  
+  
+  def tipDistanceMatrix(self):
+    # return (numTips x numTips) array of path distances between the tips
+    #  returned by geometry.getTips(), in the same order
+    tips, tipPositions = self.geometry.getTips()
+    return self.distanceMatrix(tips, tipPositions)
+  
+  
+  def _buildTree(self, pDF):
+    # make a tree node at each port of each segment, and at any segment end
+    #  without a port. Within a segment, nodes are chained outward from the
+    #  port where the segment is entered from the root.
+    segments = pDF._segments
+    portOffsets, portLocations = pDF._portOffsets, pDF._portLocations
+    portDistances, predecessors = pDF._portDistances, pDF._predecessors
+    portSegments = pDF._portSegments
+    
+    self._segmentIndex = pDF._segmentIndex
+    self._segmentLengths = pDF._segmentLengths
+    self._nodeOffsets = [0]
+    self._nodeLocations = []
+    self._entryLocations = np.empty(len(segments))
+    self._entryDistances = np.empty(len(segments))
+    parents = []
+    rootDistances = []
+    portNodes = np.empty(len(portLocations), dtype=int)
+    entryPorts = []
+    for segInd in range(len(segments)):
+      start, stop = portOffsets[segInd], portOffsets[segInd + 1]
+      ports = range(start, stop)
+      entries = [port for port in ports if portDistances[port] < np.inf and
+                 (predecessors[port] < 0 or
+                  portSegments[predecessors[port]] != segInd)]
+      if not entries:
+        # unreachable segment
+        self._entryLocations[segInd] = np.nan
+        self._entryDistances[segInd] = np.inf
+        self._nodeOffsets.append(len(self._nodeLocations))
+        continue
+      entryPort = entries[0]
+      entryLoc = portLocations[entryPort]
+      entryD = portDistances[entryPort]
+      self._entryLocations[segInd] = entryLoc
+      self._entryDistances[segInd] = entryD
+      
+      locations = sorted(set(portLocations[start:stop]) | {0.0, 1.0})
+      firstNode = len(self._nodeLocations)
+      entryInd = locations.index(entryLoc)
+      length = self._segmentLengths[segInd]
+      for ind, location in enumerate(locations):
+        if ind < entryInd:
+          parents.append(firstNode + ind + 1)
+        elif ind > entryInd:
+          parents.append(firstNode + ind - 1)
+        else:
+          # connected to parent segment later, once every node is numbered
+          parents.append(-1)
+          entryPorts.append((firstNode + ind, entryPort))
+        rootDistances.append(entryD + length * abs(location - entryLoc))
+      self._nodeLocations.extend(locations)
+      self._nodeOffsets.append(len(self._nodeLocations))
+      for port in ports:
+        portNodes[port] = firstNode + locations.index(portLocations[port])
+    
+    for node, entryPort in entryPorts:
+      if predecessors[entryPort] >= 0:
+        parents[node] = portNodes[predecessors[entryPort]]
+    
+    self._parents = np.array(parents, dtype=int)
+    self._rootDistances = np.array(rootDistances)
+  
+  
+  def _buildLCA(self):
+    # make an Euler tour of the tree, and a sparse table to find the
+    #  shallowest node visited between any two points in the tour
+    parents = self._parents
+    numNodes = len(parents)
+    children = [[] for node in range(numNodes)]
+    for node, parent in enumerate(parents.tolist()):
+      if parent < 0:
+        root = node
+      else:
+        children[parent].append(node)
+    
+    # iterative depth-first traversal, revisiting each node after each child
+    tour, tourDepths = [], []
+    firstVisits = np.empty(numNodes, dtype=int)
+    stack = [(root, 0, 0)]
+    while stack:
+      node, depth, childInd = stack.pop()
+      if childInd == 0:
+        firstVisits[node] = len(tour)
+      tour.append(node)
+      tourDepths.append(depth)
+      if childInd < len(children[node]):
+        stack.append((node, depth, childInd + 1))
+        stack.append((children[node][childInd], depth + 1, 0))
+    
+    tour = np.array(tour, dtype=int)
+    tourDepths = np.array(tourDepths, dtype=int)
+    tourLen = len(tour)
+    # table[k, i] is the position in tour of the shallowest node in
+    #  tour[i:i + 2**k]
+    numLevels = max(1, int(tourLen).bit_length())
+    table = np.zeros((numLevels, tourLen), dtype=int)
+    table[0] = np.arange(tourLen)
+    for k in range(1, numLevels):
+      half = 1 << (k - 1)
+      left, right = table[k - 1, :tourLen - half], table[k - 1, half:]
+      table[k, :tourLen - half] = np.where(
+        tourDepths[left] <= tourDepths[right], left, right)
+    
+    self._tour = tour
+    self._tourDepths = tourDepths
+    self._firstVisits = firstVisits
+    self._sparseTable = table
+  
+  
+  def _lca(self, nodesA, nodesB):
+    # return array of lowest common ancestors of nodesA and nodesB
+    firstA, firstB = self._firstVisits[nodesA], self._firstVisits[nodesB]
+    lows, highs = np.minimum(firstA, firstB), np.maximum(firstA, firstB)
+    levels = np.log2(highs - lows + 1).astype(int)
+    left = self._sparseTable[levels, lows]
+    right = self._sparseTable[levels, highs - (1 << levels) + 1]
+    return self._tour[np.where(self._tourDepths[left] <= self._tourDepths[right],
+                               left, right)]
+  
+  
+  def _locatePoints(self, segments, positions):
+    # return arrays of (node, distance from root) for each of segments at
+    #  positions. node is the closest tree node at or beyond the point, on the
+    #  side away from the root.
+    positions = np.broadcast_to(np.asarray(positions, dtype=float),
+                                (len(segments),))
+    nodes = np.empty(len(segments), dtype=int)
+    rootDs = np.empty(len(segments))
+    for ind, (segment, pos) in enumerate(zip(segments, positions.tolist())):
+      segInd = self._segmentIndex.get(segment)
+      if segInd is None or self._entryDistances[segInd] == np.inf:
+        raise KeyError('%s is not reachable from the soma' % segment.name)
+      start, stop = self._nodeOffsets[segInd], self._nodeOffsets[segInd + 1]
+      entryLoc = self._entryLocations[segInd]
+      if pos < entryLoc:
+        nodes[ind] = bisect_right(self._nodeLocations, pos, start, stop) - 1
+      else:
+        nodes[ind] = bisect_left(self._nodeLocations, pos, start, stop)
+      rootDs[ind] = self._entryDistances[segInd] + \
+                    self._segmentLengths[segInd] * abs(pos - entryLoc)
+    return nodes, rootDs
+  
+  
+  def _pointDistances(self, nodesA, rootDsA, nodesB, rootDsB):
+    # return path distances between points, given each point's node and its
+    #  distance from the root. The paths from the root to the two points split
+    #  at the LCA of their nodes, unless one point lies between the other and
+    #  the root.
+    nodesA, nodesB = np.broadcast_arrays(nodesA, nodesB)
+    splitDs = np.minimum(np.minimum(rootDsA, rootDsB),
+                         self._rootDistances[self._lca(nodesA, nodesB)])
+    return rootDsA + rootDsB - 2.0 * splitDs
+
+
+
+"""
+class PathDistanceCache
+Least-recently-used cache of PathDistanceFinders for one geometry, keyed by
+(start segment/branch, position). The cache empties itself when the
+geometry's topology changes (e.g. checkConnectivity removing disconnected
+pieces, findBranches, or mergeBranches*).
+  .get(segment, pos)
+  .hits, .misses count cache use
+"""
+class PathDistanceCache(object):
+  def __init__(self, geometry, maxSize=8):
+    self.geometry = geometry
+    self.maxSize = maxSize
+    self.hits = 0
+    self.misses = 0
+    self._finders = OrderedDict()
+    self._topologyVersion = geometry._topologyVersion
+  
+  
+  def get(self, segment, pos=0.5):
+    # return PathDistanceFinder starting from segment at pos
+    # (get segments first, in case that builds lazily-created objects)
+    segments = self.geometry.segments
+    if self._topologyVersion != self.geometry._topologyVersion:
+      self.clear()
+    if type(segment) == int:
+      segment = segments[segment]
+    key = (segment, pos)
+    pDF = self._finders.get(key)
+    if pDF is not None:
+      self.hits += 1
+      self._finders.move_to_end(key)
+      return pDF
+    
+    self.misses += 1
+    pDF = PathDistanceFinder(self.geometry, segment, pos)
+    self._finders[key] = pDF
+    while len(self._finders) > self.maxSize:
+      self._finders.popitem(last=False)
+    return pDF
+  
+  
+  def clear(self):
+    # discard all cached PathDistanceFinders
+    self._finders.clear()
+    self._topologyVersion = self.geometry._topologyVersion
+  
+  
+  def __len__(self):
+    return len(self._finders)
+
+
+
+"""
+class SegmentGraph
+Compressed sparse row (CSR) view of the neighbor relations of a list of
+segments (or branches). The connections of objects[n] are entries
+k = indptr[n] ... indptr[n+1]-1 of:
+  indices[k]       index of the neighbor in objects
+  locations[k, :]  (location in objects[n], location in the neighbor)
+  nodes[k]         index of the connecting node in geometry.nodes (-1 if it
+                   isn't there)
+Neighbors that are not in objects are left out. The arrays are a snapshot:
+build a new SegmentGraph (or use Geometry.getSegmentGraph()) after the
+topology changes.
+  .index(obj) returns the index of obj in objects
+  .componentLabels, .numComponents describe the connected components
+  .fundamentalCycles() lists the loops
+  .toSparse() returns a scipy.sparse.csr_matrix, for scipy.sparse.csgraph
+"""
+class SegmentGraph(object):
+  def __init__(self, objects, nodes):
+    self.objects = objects
+    self._objectIndex = {obj : n for n, obj in enumerate(objects)}
+    nodeIndex = {node : n for n, node in enumerate(nodes)}
+    
+    indptr = [0]
+    indices = []
+    locations = []
+    nodeIds = []
+    for obj in objects:
+      for neighbor, (loc, nLoc, node) in zip(obj.neighbors,
+                                             obj.neighborLocations):
+        ind = self._objectIndex.get(neighbor)
+        if ind is None:
+          continue
+        indices.append(ind)
+        locations.append((loc, nLoc))
+        nodeIds.append(nodeIndex.get(node, -1))
+      indptr.append(len(indices))
+    
+    self.indptr = np.array(indptr, dtype=int)
+    self.indices = np.array(indices, dtype=int)
+    self.locations = np.array(locations, dtype=float).reshape(-1, 2)
+    self.nodes = np.array(nodeIds, dtype=int)
+    self._componentLabels = None
+  
+  
+  def __len__(self):
+    return len(self.objects)
+  
+  
+  def index(self, obj):
+    """
+    return index of obj (segment or branch) in self.objects
+    """
+    return self._objectIndex[obj]
+  
+  
+  @property
+  def componentLabels(self):
+    """
+    array with the connected component of each object, found by union-find
+    over the connections. Components are numbered in order of their first
+    object.
+    """
+    if self._componentLabels is None:
+      parents = list(range(len(self.objects)))
+      def _find(n):
+        # find root of n, halving the path to it
+        while parents[n] != n:
+          parents[n] = parents[parents[n]]
+          n = parents[n]
+        return n
+      
+      rows = np.repeat(np.arange(len(self.objects)), np.diff(self.indptr))
+      for n0, n1 in zip(rows.tolist(), self.indices.tolist()):
+        root0, root1 = _find(n0), _find(n1)
+        if root0 < root1:
+          parents[root1] = root0
+        elif root1 < root0:
+          parents[root0] = root1
+      # each root is the first object in its component
+      roots = [_find(n) for n in range(len(self.objects))]
+      self._componentLabels = np.unique(roots, return_inverse=True)[1] \
+                                .reshape(-1)
+    return self._componentLabels
+  
+  
+  @property
+  def numComponents(self):
+    return int(self.componentLabels.max()) + 1 if len(self.objects) else 0
+  
+  
+  def toSparse(self, weights=None):
+    """
+    return scipy.sparse.csr_matrix adjacency matrix of the graph. Entries are
+    1.0, or weights[k] for connection k if weights is specified. Objects
+    connected more than once have duplicate entries (see
+    csr_matrix.sum_duplicates()).
+    """
+    if weights is None:
+      weights = np.ones(len(self.indices))
+    numObjects = len(self.objects)
+    return sparse.csr_matrix((weights, self.indices, self.indptr),
+                             shape=(numObjects, numObjects))
+  
+  
+  def fundamentalCycles(self):
+    """
+    return the fundamental cycles (loops) of the graph, found in one
+    spanning-tree pass. Objects meeting at a node form a junction, so objects
+    that meet at the same node are not considered to form a loop. Each cycle
+    is a list of (object index, location in, location out) around the loop.
+    A graph with c cycles needs c cuts to become a tree.
+    """
+    numObjects = len(self.objects)
+    # build the bipartite graph of objects and the junctions they touch:
+    #   vertices 0 ... numObjects-1 are objects, the rest are junctions
+    junctionIndex = {}
+    incidences = set()
+    rows = np.repeat(np.arange(numObjects), np.diff(self.indptr))
+    for obj, neighbor, (loc, nLoc), node in zip(rows.tolist(),
+                                                self.indices.tolist(),
+                                                self.locations.tolist(),
+                                                self.nodes.tolist()):
+      if node >= 0:
+        key = node
+      else:
+        # connecting node isn't known, so this connection is its own junction
+        key = (min((obj, loc), (neighbor, nLoc)),
+               max((obj, loc), (neighbor, nLoc)))
+      junction = junctionIndex.setdefault(key, numObjects + len(junctionIndex))
+      incidences.add((obj, loc, junction))
+    incidences = sorted(incidences)
+    
+    adjacency = [[] for n in range(numObjects + len(junctionIndex))]
+    for edge, (obj, loc, junction) in enumerate(incidences):
+      adjacency[obj].append((junction, edge))
+      adjacency[junction].append((obj, edge))
+    
+    # breadth-first spanning forest, recording the edge to each parent
+    parents = [-1] * len(adjacency)
+    parentEdges = [-1] * len(adjacency)
+    depths = [-1] * len(adjacency)
+    treeEdges = set()
+    for start in range(numObjects):
+      if depths[start] >= 0:
+        continue
+      depths[start] = 0
+      queue = deque([start])
+      while queue:
+        vertex = queue.popleft()
+        for neighbor, edge in adjacency[vertex]:
+          if depths[neighbor] < 0:
+            depths[neighbor] = depths[vertex] + 1
+            parents[neighbor] = vertex
+            parentEdges[neighbor] = edge
+            treeEdges.add(edge)
+            queue.append(neighbor)
+    
+    # each edge not in the spanning forest closes one fundamental cycle
+    cycles = []
+    for edge, (obj, loc, junction) in enumerate(incidences):
+      if edge in treeEdges:
+        continue
+      # walk up from both ends to their lowest common ancestor
+      path0, path1 = [obj], [junction]
+      edges0, edges1 = [], []
+      while path0[-1] != path1[-1]:
+        if depths[path0[-1]] >= depths[path1[-1]]:
+          edges0.append(parentEdges[path0[-1]])
+          path0.append(parents[path0[-1]])
+        else:
+          edges1.append(parentEdges[path1[-1]])
+          path1.append(parents[path1[-1]])
+      # vertices around the loop, with cycleEdges[i] joining vertex i to i+1
+      vertices = path0 + path1[-2::-1]
+      cycleEdges = edges0 + edges1[::-1] + [edge]
+      edgeLocs = [incidences[e][1] for e in cycleEdges]
+      cycles.append([(vertex, edgeLocs[i - 1], edgeLocs[i])
+                     for i, vertex in enumerate(vertices)
+                     if vertex < numObjects])
+    return cycles
+
+
+
 class Geometry:
   def __init__(self, _fileName = None):
     # who knows, do something?
@@ -267,8 +1252,14 @@ class Geometry:
     # helper sets for efficient deleting
     self._removeNodes = set()
     self._removeSegments = set()
-    # keep track of which objects have had connectivity checked
-    self._connectivityChecked = set()
+    # results of checkConnectivity, keyed by _connectivityKey()
+    self._connectivityChecked = {}
+    # incremented whenever segments, branches or their connections change, so
+    # that cached PathDistanceFinders etc. can be discarded
+    self._topologyVersion = 0
+    self.pathDistanceCache = PathDistanceCache(self)
+    self._geodesicIndex = None
+    self._segmentGraphs = {}
     
     self._soma = None
     self._somaBranch = None
@@ -295,6 +1286,47 @@ class Geometry:
     return len(self.compartments)
   
   
+  def getPathDistanceFinder(self, segment, pos=0.5):
+    """
+    return PathDistanceFinder starting from segment (or branch) at pos, reusing
+    a cached one if possible (see self.pathDistanceCache)
+    """
+    return self.pathDistanceCache.get(segment, pos)
+  
+  
+  def getGeodesicIndex(self):
+    """
+    return GeodesicIndex for constant-time path distances between any two
+    points in the (loop-free) neuron. The index is kept until the topology
+    changes.
+    """
+    if self._geodesicIndex is None or \
+        self._geodesicIndex[0] != self._topologyVersion:
+      self._geodesicIndex = (self._topologyVersion, GeodesicIndex(self))
+    return self._geodesicIndex[1]
+  
+  
+  def getSegmentGraph(self, branches=False):
+    """
+    return SegmentGraph (CSR arrays) of the connections between segments, or
+    between branches if branches is True. The graph is kept until the
+    topology changes.
+    """
+    objects = self.branches if branches else self.segments
+    version, graph = self._segmentGraphs.get(branches, (None, None))
+    if version != self._topologyVersion:
+      graph = SegmentGraph(objects, self.nodes)
+      self._segmentGraphs[branches] = (self._topologyVersion, graph)
+    return graph
+  
+  
+  def _topologyChanged(self):
+    """
+    Record that segments, branches, compartments or their connections changed
+    """
+    self._topologyVersion += 1
+  
+  
   def readGeometry(self):
     raise RuntimeError( \
       'Geometry must be a subclass that knows how to read files')  
@@ -406,17 +1438,15 @@ class Geometry:
             % (self.surfaceArea/self.volume))
 
     # make a path distance finder centered at the soma
-    pDF = PathDistanceFinder(self, self.soma)
+    pDF = self.getPathDistanceFinder(self.soma)
     # find all the neuron tips
     tips, tipPositions = self.getTips()
     # measure path lengths from Soma to tips
-    pathLengths = [pDF.distanceTo(tip, pos)
-                   for tip, pos in zip(tips, tipPositions)]
+    pathLengths = pDF.distancesTo(tips, tipPositions).tolist()
     _dispListStats(pathLengths, display=display,
                    printName='Path length from Soma to tips')
     # measure tortuosities from Soma to tips
-    tortuosities = [pDF.tortuosityTo(tip, pos)
-                    for tip, pos in zip(tips, tipPositions)]
+    tortuosities = pDF.tortuositiesTo(tips, tipPositions).tolist()
     _dispListStats(tortuosities, display=display,
                    printName='Tortuosity of path from Soma to tips')
   
@@ -584,6 +1614,7 @@ class Geometry:
       somaBranch.neighbors = []
     
     self.branches = [somaBranch]
+    self._topologyChanged()
     
     openBranches = [(somaBranch, 0, somaNeighbors0), \
                      (somaBranch, 1, somaNeighbors1)]
@@ -729,13 +1760,13 @@ class Geometry:
   
   def calcForewardBranchOrder(self, doPlot=True, printAxonInfo=False):
     somaPos = self.soma.centroidPosition(mandateTag='Soma')
-    pDF = PathDistanceFinder(self, self.soma, somaPos)
+    pDF = self.getPathDistanceFinder(self.soma, somaPos)
     for segment in self.segments:
       segment.branchOrder = pDF.branchOrder(segment)
     
     self.findBranches()
     somaPos = self.somaBranch.centroidPosition(mandateTag='Soma')
-    pDF = PathDistanceFinder(self, self.somaBranch, somaPos)
+    pDF = self.getPathDistanceFinder(self.somaBranch, somaPos)
     for branch in self.branches:
       branch.branchOrder = pDF.branchOrder(branch)
   
@@ -748,141 +1779,197 @@ class Geometry:
     Every other segment is labeled with centripetal order equal to the length
     of the longest path from an end to that segment, provided that allowable
     paths ALWAYS move towards the soma.
+    Also compute Strahler order: ends have Strahler order 1, and every other
+    segment has the largest Strahler order of its children (neighbors with
+    higher branchOrder), plus one if two or more children have that order.
+    
+    geometry.calcCentripetalOrder() sets segment.centripetalOrder and
+    segment.strahlerOrder to these values for all segments in network
     
-    geometry.calcCentripetalOrder() sets segment.centripetalOrder set to this
-    value for all segments in network
+    Return arrays centripetalOrders, strahlerOrders (in order of network)
     """
 
     if network is None or not network:
       self.findBranches()
       network = self.branches
-
-    def _isEnd(segment):
-      return all(segment.branchOrder >= n.branchOrder
-                 for n in segment.neighbors)
-    ends = [segment for segment in network if _isEnd(segment)]
-    for segment in ends:
-      if 'Soma' in segment.tags:
-        print('FUCK')
-        print(segment.branchOrder)
-        print([n.branchOrder for n in segment.neighbors])
-        print(all(segment.branchOrder >= n.branchOrder
-                 for n in segment.neighbors))
-
-    for segment in network:
-      segment.centripetalOrder = -1
-    for segment in ends:
-      # mark each end as having centripetal order 0
-      segment.centripetalOrder = 0
-      # now find paths from each end towards the soma. Each segment's
-      # centripetal order is the length of the longest path from an end to the
-      # segment, PROVIDED that the path ALWAYS moves towards the soma
-      openSegs = [segment]
-      while openSegs:
-        currentSeg = openSegs.pop()
-        neighborCentripOrder = currentSeg.centripetalOrder + 1
-        for neighbor in currentSeg.neighbors:
-          # look for new paths to soma, insisting that:
-          #   1. The path ALWAYS moves closer to soma
-          #   2. There isn't already a longer path through this area
-          if neighbor.branchOrder < currentSeg.branchOrder and \
-             neighbor.centripetalOrder < neighborCentripOrder:
-            # this is a new (good) path, so mark the centripetal order and
-            # continue it
-            neighbor.centripetalOrder = neighborCentripOrder
-            openSegs.append(neighbor)
+    if network is self.branches:
+      graph = self.getSegmentGraph(branches=True)
+    elif network is self.segments:
+      graph = self.getSegmentGraph()
+    else:
+      graph = SegmentGraph(network, self.nodes)
+    
+    indptr = graph.indptr.tolist()
+    indices = graph.indices.tolist()
+    branchOrders = [segment.branchOrder for segment in network]
+    centripetalOrders = [0] * len(network)
+    strahlerOrders = [1] * len(network)
+    # visit segments in decreasing branchOrder, so that every segment comes
+    # after all its children (i.e. post-order on the soma-rooted tree)
+    for ind in sorted(range(len(network)), key=lambda i: -branchOrders[i]):
+      order = branchOrders[ind]
+      children = {n for n in indices[indptr[ind]:indptr[ind+1]]
+                  if branchOrders[n] > order}
+      if not children:
+        # this is an end
+        continue
+      # the longest path from an end moving towards the soma arrives via
+      # the child with the largest centripetal order
+      centripetalOrders[ind] = 1 + max(centripetalOrders[n] for n in children)
+      childStrahler = [strahlerOrders[n] for n in children]
+      maxStrahler = max(childStrahler)
+      strahlerOrders[ind] = maxStrahler + 1 \
+                            if childStrahler.count(maxStrahler) > 1 \
+                            else maxStrahler
+    
+    for segment, centripetalOrder, strahlerOrder in \
+        zip(network, centripetalOrders, strahlerOrders):
+      segment.centripetalOrder = centripetalOrder
+      segment.strahlerOrder = strahlerOrder
+    return np.array(centripetalOrders, dtype=int), \
+           np.array(strahlerOrders, dtype=int)
+  
+  
+  def subtreeAggregates(self):
+    """
+    Compute totals over the subtree downstream of each branch (the branch
+    itself plus everything further from the soma), in one post-order pass.
+    Return dict of arrays, indexed like self.branches:
+      'cableLength'    total length (um)
+      'numTips'        number of neurite tips
+      'surfaceArea'    total surface area (mm^2)
+      'volume'         total volume (mm^3)
+      'maxPathLength'  longest path from the start of the branch to a tip (um)
+    Tips are the ends of branches (other than the soma branch) at nodes in
+      only one segment. The subtrees are those of a breadth-first spanning tree rooted at
+      the soma branch, so if there are loops, a branch reachable from more
+      than one parent is counted once, under the one the search reaches it
+      from first. The soma branch totals are therefore the whole-neuron sums.
+    """
+    if not self.branches:
+      self.findBranches()
+    graph = self.getSegmentGraph(branches=True)
+    indptr = graph.indptr.tolist()
+    indices = graph.indices.tolist()
+    branches = graph.objects
+    
+    # breadth-first spanning tree from the soma branch (then from any branch
+    # it can't reach), giving each branch one parent
+    parents = [-1] * len(branches)
+    visited = [False] * len(branches)
+    order = []
+    for root in [graph.index(self.somaBranch)] + list(range(len(branches))):
+      if visited[root]:
+        continue
+      visited[root] = True
+      first = len(order)
+      order.append(root)
+      while first < len(order):
+        ind = order[first]
+        first += 1
+        for n in indices[indptr[ind]:indptr[ind+1]]:
+          if not visited[n]:
+            visited[n] = True
+            parents[n] = ind
+            order.append(n)
+    
+    cableLength = np.array([b.length for b in branches], dtype=float)
+    surfaceArea = np.array([b.surfaceArea for b in branches], dtype=float)
+    volume = np.array([b.volume for b in branches], dtype=float)
+    numTips = np.zeros(len(branches), dtype=int)
+    maxPathLength = np.zeros(len(branches), dtype=float)
+    somaInd = order[0]
+    for ind, branch in enumerate(branches):
+      if ind != somaInd:
+        # branch neighbors can miss the connections that close loops, so
+        #  look for free ends at the nodes themselves
+        numTips[ind] = (len(branch.nodes[0].segments) == 1) + \
+                       (len(branch.nodes[-1].segments) == 1)
+    # visit children before their parents, adding totals into the parent
+    for ind in reversed(order):
+      maxPathLength[ind] += branches[ind].length
+      parent = parents[ind]
+      if parent < 0:
+        continue
+      cableLength[parent] += cableLength[ind]
+      surfaceArea[parent] += surfaceArea[ind]
+      volume[parent] += volume[ind]
+      numTips[parent] += numTips[ind]
+      maxPathLength[parent] = max(maxPathLength[parent], maxPathLength[ind])
+    
+    return {'cableLength' : cableLength, 'numTips' : numTips,
+            'surfaceArea' : surfaceArea, 'volume' : volume,
+            'maxPathLength' : maxPathLength}
+  
+  
+  def totalCableLength(self):
+    """
+    Return the total length of all compartments (um)
+    """
+    return sum(comp.length for comp in self.compartments)
+  
+  
+  def maxTipPathDistances(self, tips, positions=0.5, segment=None, pos=0.5):
+    """
+    For every segment, find the longest path distance from segment (default
+    soma) at pos to any of tips (at positions) whose path passes through it,
+    in one pass over the network.
+    Return (distances, tipInds), arrays indexed like self.segments:
+      distances  the longest path distance (um), NaN if no tip path passes
+                 through the segment
+      tipInds    index to tips of the tip with that distance (the earliest
+                 one if tied), -1 if none
+    """
+    pDF = self.getPathDistanceFinder(self.soma if segment is None
+                                     else segment, pos)
+    if pDF.network is not self.segments:
+      raise TypeError('Start segment must be an index to geometry.segments, or'
+                      ' an object from geometry.segments')
+    tipDistances = np.append(pDF.distancesTo(tips, positions), np.nan)
+    tipInds = pDF.pathMaxima(tips, tipDistances[:-1], positions)
+    # tipInds of -1 pick out the trailing NaN
+    distances = tipDistances[tipInds]
+    return distances, tipInds
   
   
   def checkConnectivity(self, removeDisconnected=False, checkObjects=None,
-                        debugInfo=True, removeLoops=False):
+                        debugInfo=True, removeLoops=False, validate=False,
+                        loopPolicy=None):
     """
     Compute the connectivity of the network:
       -The number/members of connected subgraphs
-      -The presence of any loops
+      -The presence of any loops (only searched for if removeLoops is True)
     if removeDisconnected is True, remove all but largest subgraph from network
+    if removeLoops is True, report any loops. If loopPolicy is also set to
+      'longest' or 'thinnest', break loops in the network of segments at
+      that compartment (see breakLoops)
+    if validate is True, also check that the neighbor lists are consistent
+      (see _validateConnectivity)
+    The result is remembered until the topology changes.
     
     Return the list of subgraphs
     """
     
     if checkObjects is None:
       checkObjects = self.segments
-    checkHash = hash(str(checkObjects)+str(removeDisconnected))
+    if not removeLoops:
+      loopPolicy = None
+    checkHash = self._connectivityKey(checkObjects, removeDisconnected,
+                                      loopPolicy)
+    if validate:
+      self._validateConnectivity(checkObjects)
     if checkHash in self._connectivityChecked:
       # don't need to check again
-      return
+      return self._connectivityChecked[checkHash]
 
-    # check to be sure that neighborhood at a location/node is transitive
-    for segment in checkObjects:
-        for neighbor, (pos, nPos, node) in zip(segment.neighbors,
-                                               segment.neighborLocations):
-          assert segment in node.segments, \
-            "%s should be in node %d's list of segments, but is not" \
-            % (segment.name, self.nodes.index(node))
-          assert neighbor in node.segments, \
-            "%s should be in node %d's list of segments, but is not" \
-            % (neighbor.name, self.nodes.index(node))
-          for n2, (pos2, nPos2, node2) in zip(neighbor.neighbors,
-                                              neighbor.neighborLocations):
-            if node2 != node:
-              continue
-            assert n2 == segment or n2 in segment.neighbors, \
-                   "%s and %s are neighbors at node %d, and so are %s and %s,"\
-                   " but %s and %s are not" % (segment.name, neighbor.name,
-                   self.nodes.index(node), neighbor.name, n2.name,
-                   segment.name, n2.name)
-
-    subGraphs = []
-    checkObjs = {obj for obj in checkObjects}
-    while checkObjs:
-      # start checking new subgraph
-      start = checkObjs.pop()
-      connected = { (start, None) }
-      subGraph = { start }
-      pathSegNames = { start : [start.name] }
-      paths = {start : []}
-      
-      while connected:
-        # find all the elements connected to this subgraph
-        segment, startNode = connected.pop()
-        for neighbor, (pos, nPos, node) in zip(segment.neighbors,
-                                               segment.neighborLocations):
-          if node == startNode and neighbor != segment:
-            # this is just backtracking
-            continue
-          if neighbor in checkObjs:
-            connected.add((neighbor, node))
-            subGraph.add(neighbor)
-            checkObjs.remove(neighbor)
-            pathSegNames[neighbor] = pathSegNames[segment] + [neighbor.name]
-            paths[neighbor] = paths[segment] + [(segment, node, neighbor)]
-          else:
-            # there is a loop!
-            names1 = pathSegNames[segment]
-            try:
-              names2 = pathSegNames[neighbor]
-            except KeyError as err:
-              print(segment.name, neighbor.name, neighbor in self.segments,
-                    neighbor in checkObjs, neighbor in subGraph,
-                    neighbor in pathSegNames)
-              print([neighbor in s for s in subGraphs])
-              raise err
-                
-            ind = 0
-            for name1, name2 in zip(names1, names2):
-              if name1 != name2:
-                ind -= 1
-                break
-              ind += 1
-            loopSegNames = names1[ind:] + names2[:ind-1:-1]
-            if removeLoops:
-              #loops.append(loopSegNames)
-              warn('Have not implement loop removal.\nLoop detected',
-                    '->'.join(loopSegNames))
-            else:
-              pass
-              # warn('Loop detected', '->'.join(loopSegNames))
-      
-      subGraphs.append(subGraph)
+    # find the connected subgraphs from the CSR neighbor arrays
+    if checkObjects is self.segments:
+      graph = self.getSegmentGraph()
+    else:
+      graph = SegmentGraph(checkObjects, self.nodes)
+    subGraphs = [set() for n in range(graph.numComponents)]
+    for obj, label in zip(graph.objects, graph.componentLabels.tolist()):
+      subGraphs[label].add(obj)
     
     # sort the subgraphs so that the largest is first
     if isinstance(checkObjects[0], Segment):
@@ -933,40 +2020,226 @@ class Geometry:
       self.branches = []
       if self._somaBranch is not None:
         self._somaBranch[0].neighbors = []
-      
-      checkHash = hash(str(checkObjects)+str(removeDisconnected))
+      self._topologyChanged()
       
       print("Removed all but largest subgraphs")
     
+    if removeLoops:
+      if loopPolicy is not None and checkObjects is self.segments:
+        self.breakLoops(loopPolicy, debugInfo=debugInfo)
+      else:
+        for loop, loopLength in self.findLoops(checkObjects):
+          warn('Loop detected (length %.1f)' % loopLength,
+               '->'.join(obj.name for obj, loc0, loc1 in loop))
+    
+    # the topology may have changed, so recompute the key
+    checkHash = self._connectivityKey(checkObjects, removeDisconnected,
+                                      loopPolicy)
     # record that the connectivity is already checked
-    self._connectivityChecked.add(checkHash)
+    self._setConnectivityChecked(checkHash, subGraphs)
     
     return subGraphs
 
 
-  def _plotShollGraph(self, distances):
+  def _connectivityKey(self, checkObjects, removeDisconnected,
+                       loopPolicy=None):
     """
-    Plot the number of neurites at a given distance
+    Return key recording that connectivity of checkObjects has been checked
+    """
+    objectsKey = None if checkObjects is self.segments else tuple(checkObjects)
+    return (self._topologyVersion, objectsKey, removeDisconnected, loopPolicy)
+
+
+  def _setConnectivityChecked(self, checkHash, subGraphs):
+    """
+    Remember the subGraphs found by checkConnectivity, forgetting any results
+    from before the last topology change
+    """
+    self._connectivityChecked = {
+      key : value for key, value in self._connectivityChecked.items()
+      if key[0] == self._topologyVersion}
+    self._connectivityChecked[checkHash] = subGraphs
+
+
+  def _validateConnectivity(self, checkObjects):
+    """
+    Assert that connections are consistent: each connecting node lists both
+    connected objects, and neighborhood at a node is transitive
+    """
+    nodeIndex = {node : n for n, node in enumerate(self.nodes)}
+    for segment in checkObjects:
+      for neighbor, (pos, nPos, node) in zip(segment.neighbors,
+                                             segment.neighborLocations):
+        assert segment in node.segments, \
+          "%s should be in node %d's list of segments, but is not" \
+          % (segment.name, nodeIndex.get(node, -1))
+        assert neighbor in node.segments, \
+          "%s should be in node %d's list of segments, but is not" \
+          % (neighbor.name, nodeIndex.get(node, -1))
+        for n2, (pos2, nPos2, node2) in zip(neighbor.neighbors,
+                                            neighbor.neighborLocations):
+          if node2 != node:
+            continue
+          assert n2 == segment or n2 in segment.neighbors, \
+                 "%s and %s are neighbors at node %d, and so are %s and %s,"\
+                 " but %s and %s are not" % (segment.name, neighbor.name,
+                 nodeIndex.get(node, -1), neighbor.name, n2.name,
+                 segment.name, n2.name)
+
+
+  def findLoops(self, checkObjects=None):
+    """
+    Find the loops in the network (segments by default, or checkObjects),
+    with one spanning-tree pass (see SegmentGraph.fundamentalCycles)
+    Return list of (loop, loopLength) tuples, where loop is a list of
+      (object, location in, location out) around the loop and loopLength is
+      the path length around the loop
     """
+    if checkObjects is None:
+      checkObjects = self.segments
+    if checkObjects is self.segments:
+      graph = self.getSegmentGraph()
+    else:
+      graph = SegmentGraph(checkObjects, self.nodes)
     
-    # neuriteDistance starts at zero, and has two data points for each
-    # distance: one with the previous (running) number of compartments, and one
-    # with the change added in (running +1 or -1)
-    runningNum = 0
-    neuriteDistance = [0.0]
-    numIntersections = [0]
-    lastNeuriteDistance = 0.0
-    for d in distances:
-      if d[0] > lastNeuriteDistance:
-        neuriteDistance.append(lastNeuriteDistance)
-        numIntersections.append(runningNum)
-        neuriteDistance.append(d[0])
-        numIntersections.append(runningNum)
-        lastNeuriteDistance = d[0]
-      runningNum += d[1]
-    neuriteDistance.append(lastNeuriteDistance)
-    numIntersections.append(runningNum)
+    loops = []
+    for cycle in graph.fundamentalCycles():
+      loop = [(graph.objects[n], loc0, loc1) for n, loc0, loc1 in cycle]
+      loopLength = sum(obj.length * abs(loc1 - loc0)
+                       for obj, loc0, loc1 in loop)
+      loops.append((loop, loopLength))
+    return loops
+  
+  
+  def breakLoops(self, policy='longest', debugInfo=True):
+    """
+    Remove all loops from the network of segments, by breaking each one at
+      its longest compartment (policy='longest') or its thinnest compartment
+      (policy='thinnest'). The segment holding that compartment is detached
+      from the neighbors at whichever end of the loop is closer to it, so
+      path distances etc. can use the fast tree algorithms afterwards.
+    Return the list of loops that were broken (see findLoops)
+    """
+    if policy == 'longest':
+      def _badness(comp):
+        return comp.length
+    elif policy == 'thinnest':
+      def _badness(comp):
+        return -comp.avgRadius
+    else:
+      raise ValueError('Unknown loop-breaking policy: %s' % policy)
+    
+    brokenLoops = []
+    loops = self.findLoops()
+    while loops:
+      # loops that share no connections can be broken at the same time
+      # without disconnecting anything
+      usedConnections = set()
+      cuts = []
+      for loop, loopLength in loops:
+        connections = set()
+        for segment, loc0, loc1 in loop:
+          connections.add((segment, loc0))
+          connections.add((segment, loc1))
+        if not connections.isdisjoint(usedConnections):
+          continue
+        usedConnections.update(connections)
+        cuts.append(self._loopCut(loop, _badness))
+        brokenLoops.append((loop, loopLength))
+        if debugInfo:
+          segment, location = cuts[-1]
+          warn('Breaking loop (length %.1f)' % loopLength,
+               '->'.join(seg.name for seg, loc0, loc1 in loop)
+               + '\ndetaching %s at %g' % (segment.name, location))
+      for segment, location in cuts:
+        self._detachSegment(segment, location)
+      loops = self.findLoops()
     
+    return brokenLoops
+  
+  
+  @staticmethod
+  def _loopCut(loop, _badness):
+    """
+    return (segment, location) where loop should be broken: the end of the
+    loop's path through the segment holding its worst compartment
+    """
+    worst = None
+    for segment, loc0, loc1 in loop:
+      if not segment.nodeLocations:
+        segment._setNodeLocations()
+      locs = segment.nodeLocations
+      lo, hi = min(loc0, loc1), max(loc0, loc1)
+      for ind, comp in enumerate(segment.compartments):
+        if locs[ind] < lo or locs[ind + 1] > hi:
+          continue
+        badness = _badness(comp)
+        if worst is None or badness > worst[0]:
+          midLoc = 0.5 * (locs[ind] + locs[ind + 1])
+          cutLoc = loc0 if abs(midLoc - loc0) <= abs(midLoc - loc1) else loc1
+          worst = (badness, segment, cutLoc)
+    if worst is None:
+      # no compartments on the loop, cut anywhere
+      segment, loc0, loc1 = loop[0]
+      return segment, loc0
+    return worst[1], worst[2]
+  
+  
+  def _detachSegment(self, segment, location):
+    """
+    Disconnect segment from all its neighbors at location, giving it its own
+    copy of the connecting node
+    """
+    self._topologyChanged()
+    node = None
+    while True:
+      ind = next((ind for ind, (loc, nLoc, n)
+                  in enumerate(segment.neighborLocations) if loc == location),
+                 None)
+      if ind is None:
+        break
+      neighbor = segment.neighbors.pop(ind)
+      loc, nLoc, node = segment.neighborLocations.pop(ind)
+      nInd = _neighborIndex(neighbor, segment, nLoc, loc, node)
+      neighbor.neighbors.pop(nInd)
+      neighbor.neighborLocations.pop(nInd)
+    
+    if not isinstance(node, Node):
+      # nothing was connected, or node is a NodeView in a GeometryStore; those
+      #  can't be copied, so the node just stays shared
+      return
+    
+    # copy the node and use the copy in segment and its compartment there
+    if not segment.nodeLocations:
+      segment._setNodeLocations()
+    ind = next(ind for ind, (n, loc) in enumerate(zip(segment.nodes,
+                                                      segment.nodeLocations))
+               if n is node and loc == location)
+    newNode = Node(node.x, node.y, node.z, node.r1, node.r2, node.r3,
+                   node.theta, node.phi)
+    newNode.tags.update(node.tags)
+    segment.nodes[ind] = newNode
+    newNode.segments.append(segment)
+    if node not in segment.nodes:
+      node.segments.remove(segment)
+    # the node ends the compartment before it and starts the one after it
+    for compInd, nodeInd in ((ind - 1, -1), (ind, 0)):
+      if not 0 <= compInd < len(segment.compartments):
+        continue
+      comp = segment.compartments[compInd]
+      if comp.nodes[nodeInd] is not node:
+        continue
+      comp.nodes[nodeInd] = newNode
+      newNode.compartments.append(comp)
+      if node not in comp.nodes:
+        node.compartments.remove(comp)
+    self.nodes.append(newNode)
+  
+  
+  def _plotShollGraph(self, neuriteDistance, numIntersections):
+    """
+    Plot the number of neurites at a given distance
+    """
     fig = pyplot.figure()
     pyplot.plot(neuriteDistance, numIntersections, 'k-')
     pyplot.title('Sholl Analysis', fontsize=22)
@@ -978,75 +2251,82 @@ class Geometry:
     for tick in ax.yaxis.get_major_ticks():
       tick.label1.set_fontsize(16)
     pyplot.tight_layout()
+    return fig
 
   
-  def shollAnalysis(self, straightenNeurites=True):
+  def _shollEndpoints(self, straightenNeurites=True):
     """
-    Find the number of neurites that intersect a sphere of a given radius
+    Return sorted arrays with the near and far distance of each neurite piece
+    from the soma:
+      if straightenNeurites is True, the pieces are segments and distance is
+        measured along the neurites (as though the neuron was straightened)
+      otherwise the pieces are compartments (excluding the soma) and distance
+        is euclidean distance from the soma centroid
     """
-    # get the centroid of the soma, weighting each compartment's contribution
-    # by volume
-    
-    # define how distance from centroid to compartment is measured
     if straightenNeurites:
-      # get distance traveled along neurites (e.g. as though neuron was
-      # straightened out
-      
       centroid = self.soma.centroidPosition(mandateTag='Soma')
-      
-      # compute distance from soma to each segment
-      somaPaths = PathDistanceFinder(self, self.soma, centroid)
-      
-      # store results in an array
-      distances = []
-      for s in self.segments:
-        d0, d1 = somaPaths.distanceTo(s, 0.0), somaPaths.distanceTo(s, 1.0)
-        if d1 < d0:
-          d0, d1 = d1, d0
-        
-        distances.append((d0, 1))
-        distances.append((d1, -1))
-      
+      # compute distance from soma to both ends of each segment
+      somaPaths = self.getPathDistanceFinder(self.soma, centroid)
+      d0 = somaPaths.distancesTo(self.segments, 0.0)
+      d1 = somaPaths.distancesTo(self.segments, 1.0)
     else:
-      # get euclidean distance from soma centroid to each compartment
-      # (must be done compartment by compartment, because segments curve)
-
-      centroid = self.soma.centroid(mandateTag='Soma')
-      
-      # define distance from centroid to compartment
-      def _centroidDist(c):
-        def _tupleDist(_t1, _t2):
-          return sqrt( (_t1[0] - _t2[0])**2 + \
-                       (_t1[1] - _t2[1])**2 + \
-                       (_t1[2] - _t2[2])**2 )
-
-        d0 = _tupleDist(centroid, (c.x0, c.y0, c.z0))
-        d1 = _tupleDist(centroid, (c.x1, c.y1, c.z1))
-        if d0 <= d1:
-          return d0, d1
-        else:
-          return d1, d0
-      
-      # compute the distance from the soma centroid to each compartment that's
-      # not in the soma
-      distances = []
-      for c in self.compartments:
-        if 'Soma' in c.tags:
-          continue
-        d0, d1 = _centroidDist(c)
-        distances.append((d0, 1))  
-        distances.append((d1, -1))
+      # must be done compartment by compartment, because segments curve
+      centroid = np.array(self.soma.centroid(mandateTag='Soma'))
+      comps = [c for c in self.compartments if 'Soma' not in c.tags]
+      ends0 = np.array([(c.x0, c.y0, c.z0) for c in comps]).reshape(-1, 3)
+      ends1 = np.array([(c.x1, c.y1, c.z1) for c in comps]).reshape(-1, 3)
+      d0 = np.sqrt(((ends0 - centroid)**2).sum(axis=1))
+      d1 = np.sqrt(((ends1 - centroid)**2).sum(axis=1))
+    return np.sort(np.minimum(d0, d1)), np.sort(np.maximum(d0, d1))
+  
+  
+  def shollIntersections(self, radii, straightenNeurites=True):
+    """
+    Return array with the number of neurites that intersect a sphere of each
+    of the given radii around the soma (see _shollEndpoints for how distance
+    is measured)
+    """
+    starts, ends = self._shollEndpoints(straightenNeurites)
+    return self._shollCounts(starts, ends, radii)
+  
+  
+  @staticmethod
+  def _shollCounts(starts, ends, radii):
+    # pieces that start at or before each radius, minus those that also end
+    radii = np.asarray(radii, dtype=float)
+    return np.searchsorted(starts, radii, side='right') \
+      - np.searchsorted(ends, radii, side='right')
+  
+  
+  def shollAnalysis(self, straightenNeurites=True, makePlot=True):
+    """
+    Find the number of neurites that intersect a sphere of a given radius
+    Return arrays neuriteDistance, numIntersections describing the step curve
+      of the number of intersections vs distance from the soma. If makePlot is
+      True, also plot it.
+    """
+    starts, ends = self._shollEndpoints(straightenNeurites)
     
-    # sort the distances by increasing distance
-    distances.sort(key=lambda x: x[0])
+    # neuriteDistance starts at zero, and has two data points for each
+    # distance: one with the previous (running) number of compartments, and one
+    # with the change at that distance added in
+    distances = np.unique(np.concatenate((starts, ends)))
+    distances = distances[distances > 0.0]
+    counts = self._shollCounts(starts, ends, np.concatenate(([0.0], distances)))
+    # at each distance, first the previous count, then the new count
+    neuriteDistance = np.concatenate(([0.0, 0.0], np.repeat(distances, 2)))
+    numIntersections = np.concatenate(([0], np.repeat(counts, 2)[:-1]))
     
-    self._plotShollGraph(distances)
+    if makePlot:
+      self._plotShollGraph(neuriteDistance, numIntersections)
+    return neuriteDistance, numIntersections
   
     
   def _addSegment(self, name, segList=None):
     """
     Add a new segment to the model
     """
+    self._topologyChanged()
     if name in self.tags:
       raise IOError('Tried to create segment with existing name/tag')
 
@@ -1075,10 +2355,15 @@ class Geometry:
     return newNode
   
   
-  def _addCompartment(self, segment, node0, node1=None, append=False):
+  def _addCompartment(self, segment, node0, node1=None, append=False,
+                      computeGeometry=True):
     """
     Define and add compartment to geometry within specified segment
+    if computeGeometry is False, don't compute the compartment's surface area
+      and volume or add them to the geometry totals (call
+      _computeCompartmentGeometry() later, for many compartments at once)
     """
+    self._topologyChanged()
     if type(node0) is int:
       # passed an index, get the node object
       node0 = self.nodes[node0]
@@ -1108,6 +2393,8 @@ class Geometry:
           compInd += 1
         segment.compartments.insert(compInd, newComp)
     
+    segment._clearAggregates()
+    
     # add segment information to compartment
     newComp.tags.update(segment.tags)
     newComp.tags.add(segment.name)
@@ -1122,11 +2409,35 @@ class Geometry:
       self.tags[tag] += 1
     
     # update geometry totals
-    self.surfaceArea += newComp.surfaceArea
-    self.volume += newComp.volume
+    if computeGeometry:
+      self.surfaceArea += newComp.surfaceArea
+      self.volume += newComp.volume
     return newComp
   
   
+  def _computeCompartmentGeometry(self, compartments):
+    """
+    Compute the length, surface area, volume and centroid of many
+    TwoNodeCompartments in one vectorized pass, store them in the
+    compartments, and add their surface area and volume to the geometry totals
+    """
+    if not compartments:
+      return
+    ends = np.array([(c.x0, c.y0, c.z0, c.semiMajor0, c.semiMinor0,
+                      c.x1, c.y1, c.z1, c.semiMajor1, c.semiMinor1)
+                     for c in compartments], dtype=float)
+    x0, y0, z0, r0, minor0, x1, y1, z1, r1, minor1 = ends.T
+    lengths, areas, volumes, centroids = frustumGeometry(
+      x0, y0, z0, r0, x1, y1, z1, r1, minor0, minor1)
+    numDisks = np.count_nonzero((lengths == 0) & (minor0 != minor1))
+    if numDisks:
+      warn('Compartment with zero length', '%d compartments' % numDisks)
+    setCompartmentGeometry(compartments, lengths, areas, volumes, centroids)
+    # add in order, as if the compartments were added one at a time
+    self.surfaceArea += sum(areas.tolist())
+    self.volume += sum(volumes.tolist())
+  
+  
   def _connectSegments(self, segment0, location0, segment1, location1,
                        implicitConnect=True):
     """
@@ -1137,6 +2448,7 @@ class Geometry:
           AND _connectSegments is called to connect A and C and (x,y,z):
         then ensure that A, B, and C are all connected at (x,y,z)
     """
+    self._topologyChanged()
     node0 = segment0.nodeAt(location0)
     node1 = segment1.nodeAt(location1)
     # check to make sure the two nodes are identical
@@ -1269,6 +2581,7 @@ class Geometry:
     # Merge segmentA and segmentB into one segment, preserving their neighbor
     # information
     #
+    self._topologyChanged()
     assert segmentA in _segList
     assert segmentB in _segList
     assert segmentB in segmentA.neighbors and \
@@ -1308,8 +2621,9 @@ class Geometry:
         segmentA.compartments = segmentB.compartments + segmentA.compartments
         segmentA.nodes = segmentB.nodes[:-1] + segmentA.nodes
 
-    # update node locations
+    # update node locations and cached sums over compartments
     segmentA._setNodeLocations()
+    segmentA._clearAggregates()
     
     # remove segmentB from segmentA's neighbors
     _removeNeighbor(segmentA, segmentB)
@@ -1326,9 +2640,7 @@ class Geometry:
       # update the connection location in segmentA
       segmentA.neighborLocations[ind] = (newLoc, nLoc, node)
       # update the connection location in the neighbor
-      nInd = zip(neighbor.neighbors,
-                 neighbor.neighborLocations).index((segmentA,
-                                                    (nLoc, loc, node)))
+      nInd = _neighborIndex(neighbor, segmentA, nLoc, loc, node)
       neighbor.neighborLocations[nInd] = ((nLoc, newLoc, node))
     
     # replace segmentB with segmentA in other segments' neighbors
@@ -1336,9 +2648,7 @@ class Geometry:
     for neighbor, (loc, nLoc, node) in zip(segmentB.neighbors,
                                            segmentB.neighborLocations):
       # update the location
-      nInd = zip(neighbor.neighbors,
-                 neighbor.neighborLocations).index((segmentB,
-                                                    (nLoc, loc, node)))
+      nInd = _neighborIndex(neighbor, segmentB, nLoc, loc, node)
       nodeInd = segmentA.nodes.index(node)
       newLoc = segmentA.nodeLocations[nodeInd]
 
@@ -1370,37 +2680,44 @@ class Geometry:
         self.soma.centripetalOrder is None:
       self.calcBranchOrder(doPlot=False)
     
-    def _getMergePath(startB, considerBranches):
-      startLen = startB.length
-      if startB.branchOrder == 0:
-        startLen *= 0.5
-      finishedPaths = []
-      # start at startB
-      openPaths = [([startB], startLen)]
-      # find all the paths from startB to a neurite tip
-      while openPaths:
-        path, length = openPaths.pop()
-        current = path[-1] ; nextOrder = current.branchOrder + 1
-        
-        nextBranches = [n for n in current.neighbors
-                        if n.branchOrder == nextOrder]
-        if nextBranches:
-          for n in nextBranches:
-            openPaths.append((path + [n], length + n.length))
-        else:
-          finishedPaths.append((path, length))
-      
-      # return the longest path
-      return max(finishedPaths, key=lambda x:x[1])[0]
+    # find, for every branch, the child (neighbor with the next branchOrder)
+    # that starts the longest path to a neurite tip, in one post-order pass
+    graph = self.getSegmentGraph(branches=True)
+    indptr = graph.indptr.tolist()
+    indices = graph.indices.tolist()
+    branches = graph.objects
+    branchOrders = [b.branchOrder for b in branches]
+    tipDistances = [0.0] * len(branches)
+    nextBranch = [-1] * len(branches)
+    for ind in sorted(range(len(branches)), key=lambda i: -branchOrders[i]):
+      nextOrder = branchOrders[ind] + 1
+      for n in indices[indptr[ind]:indptr[ind+1]]:
+        # on ties, prefer the later child, as a depth-first search would
+        if branchOrders[n] != nextOrder:
+          continue
+        if nextBranch[ind] < 0 or \
+            tipDistances[n] >= tipDistances[nextBranch[ind]]:
+          nextBranch[ind] = n
+      tipDistances[ind] = branches[ind].length
+      if nextBranch[ind] >= 0:
+        tipDistances[ind] += tipDistances[nextBranch[ind]]
     
     self.mergedBranches = []
-    considerBranches = {b for b in self.branches}
-    
-    while considerBranches:
-      minOrder = min(b.branchOrder for b in considerBranches)
-      startB = [b for b in considerBranches
-                if b.branchOrder == minOrder].pop()
-      mergePath = _getMergePath(startB, considerBranches)
+    self._topologyChanged()
+    isMerged = [False] * len(branches)
+    # start merging from the branches closest to the soma
+    for startInd in sorted(range(len(branches)), key=lambda i: branchOrders[i]):
+      if isMerged[startInd]:
+        continue
+      # follow the longest path from startB to a tip
+      mergePath = [startInd]
+      while nextBranch[mergePath[-1]] >= 0 and \
+          not isMerged[nextBranch[mergePath[-1]]]:
+        mergePath.append(nextBranch[mergePath[-1]])
+      for ind in mergePath:
+        isMerged[ind] = True
+      startB = branches[startInd]
+      mergePath = [branches[ind] for ind in mergePath]
       
       merged = Segment(self)
       merged.name = 'MergedBranch%d' % len(self.mergedBranches)
@@ -1413,7 +2730,6 @@ class Geometry:
       # add .merged element to startB
       startB.merged = merged
       
-      considerBranches.remove(startB)
       previous = startB
       
       for b in mergePath[1:]:
@@ -1426,11 +2742,11 @@ class Geometry:
         # add .merged element to b
         b.merged = merged
         
-        considerBranches.remove(b)
         previous = b
       
-      # set nodeLocations in merged
+      # set nodeLocations in merged, and forget any sums over its compartments
       merged._setNodeLocations()
+      merged._clearAggregates()
       
       # add merged to mergedBranches
       self.mergedBranches.append(merged)
@@ -1508,6 +2824,7 @@ class Geometry:
       return mergeBranch
     
     self.mergedBranches = []
+    self._topologyChanged()
     visited = {b : False for b in self.branches}
     openBranches = {b for b in self.branches if b.centripetalOrder == 0}
     
@@ -1574,8 +2891,9 @@ class Geometry:
         barf = (current.name, current.branchOrder, current.centripetalOrder)
         current = _getMergeBranch(current)
       
-      # set nodeLocations in merged
+      # set nodeLocations in merged, and forget any sums over its compartments
       merged._setNodeLocations()
+      merged._clearAggregates()
       # add merged to mergedBranches
       self.mergedBranches.append(merged)
       # add any missed branches
@@ -1992,6 +3310,16 @@ def _makeNeighbors(segment1, segment2, location1, location2, node,
     segment2.neighborLocations.append((location2, location1, node))
 
 
+def _neighborIndex(segment, neighbor, location, nLocation, node):
+  # return index of the connection to neighbor in segment's neighbor lists
+  for ind, (n, connection) in enumerate(zip(segment.neighbors,
+                                            segment.neighborLocations)):
+    if n == neighbor and connection == (location, nLocation, node):
+      return ind
+  raise ValueError('%s is not connected to %s at %g'
+                   % (neighbor.name, segment.name, location))
+
+
 def _removeNeighbor(segment, neighbor):
   # remove neighbor from list of segment's neighbors
   ind = segment.neighbors.index(neighbor)
@@ -2076,6 +3404,7 @@ class Segment:
     self.neighborLocations = []
     #self.volume = None
     self.branchOrder = None
+    self._clearAggregates()
 
 
   
@@ -2143,6 +3472,7 @@ class Segment:
       self.geometry.compartments = [c for c in self.geometry.compartments
                                     if c not in self.compartments]
       self.compartments = []
+      self._clearAggregates()
     if self.nodes:
       delNodes = []
       for n in self.nodes:
@@ -2165,33 +3495,57 @@ class Segment:
       c.tags.add(newTag)
       self.geometry.tags[newTag] += 1
   
+  def _clearAggregates(self):
+    """
+    Forget cached sums over compartments. Must be called whenever
+    self.compartments is changed after any of them may have been read
+    """
+    self._length = None
+    self._surfaceArea = None
+    self._volume = None
+    self._maxRadius = None
+    self._minRadius = None
+    self._avgRadius = None
+  
   @property
   def length(self):
-    return sum([c.length for c in self.compartments])
+    if self._length is None:
+      self._length = sum([c.length for c in self.compartments])
+    return self._length
   
   @property
   def surfaceArea(self):
-    return sum([c.surfaceArea for c in self.compartments])
+    if self._surfaceArea is None:
+      self._surfaceArea = sum([c.surfaceArea for c in self.compartments])
+    return self._surfaceArea
   
   @property
   def maxRadius(self):
     # compute maximum radius
-    return max(c.maxRadius for c in self.compartments)
+    if self._maxRadius is None:
+      self._maxRadius = max(c.maxRadius for c in self.compartments)
+    return self._maxRadius
   
   @property
   def minRadius(self):
     # compute minimum radius
-    return min(c.minRadius for c in self.compartments)
+    if self._minRadius is None:
+      self._minRadius = min(c.minRadius for c in self.compartments)
+    return self._minRadius
   
   @property
   def avgRadius(self):
     # compute average radius, weighted by volume
-    return sum(c.avgRadius * c.volume for c in self.compartments) / \
-           sum(c.volume for c in self.compartments)
+    if self._avgRadius is None:
+      self._avgRadius = sum(c.avgRadius * c.volume
+                            for c in self.compartments) / self.volume
+    return self._avgRadius
   
   @property
   def volume(self):
-    return sum(c.volume for c in self.compartments)
+    if self._volume is None:
+      self._volume = sum(c.volume for c in self.compartments)
+    return self._volume
   
   @property
   def tortuosity(self):
@@ -2373,6 +3727,10 @@ class Node:
 
 
 class Compartment:  
+  # no per-instance storage here, so that CompartmentView can be a subclass
+  # without a __dict__ (the concrete subclasses below still have one)
+  __slots__ = ()
+  
   def __init__(self):
     # do nothing, this is a pure virtual class
     self._surfaceArea = None
@@ -2600,7 +3958,7 @@ class TwoNodeCompartment(Compartment):
     compute and set surface area
     """
     ratio0 = self.semiMinor0 / self.semiMajor0
-    ratio1 = self.semiMajor1 / self.semiMajor1
+    ratio1 = self.semiMinor1 / self.semiMajor1
     if isnan(ratio0):
       if isnan(ratio1):
         raise IOError('Degenerate (zero radius) compartment')
@@ -2724,15 +4082,299 @@ class TwoNodeCompartment(Compartment):
     """
     if self._centroid is None:
       # need to calculate centroid location
-      weightedLength = 0.5 * pi * self.length*self.length * \
-        ((self.semiMajor0 * self.semiMinor0 + \
-          self.semiMajor0 * self.semiMinor1 + \
-          self.semiMajor1 * self.semiMinor0) / 6.0 + \
-         0.5 * self.semiMajor1 * self.semiMinor1)
-      ratio1 = weightedLength / (1.0e9 * self.volume) / self.length
-      ratio0 = 1.0 - ratio1
-      self._centroid = (self.x0 * ratio0 + self.x1 * ratio1, \
-                        self.y0 * ratio0 + self.y1 * ratio1,
-                        self.z0 * ratio0 + self.z1 * ratio1)
+      self._centroid = self._calcCentroid()
     
     return self._centroid
+  
+  def _calcCentroid(self):
+    """
+    compute and return centroid
+    """
+    weightedLength = 0.5 * pi * self.length*self.length * \
+      ((self.semiMajor0 * self.semiMinor0 + \
+        self.semiMajor0 * self.semiMinor1 + \
+        self.semiMajor1 * self.semiMinor0) / 6.0 + \
+       0.5 * self.semiMajor1 * self.semiMinor1)
+    ratio1 = weightedLength / (1.0e9 * self.volume) / self.length
+    ratio0 = 1.0 - ratio1
+    return (self.x0 * ratio0 + self.x1 * ratio1, \
+            self.y0 * ratio0 + self.y1 * ratio1,
+            self.z0 * ratio0 + self.z1 * ratio1)
+
+
+
+"""
+class GeometryStore
+Compact, array-backed storage for the nodes and two-node compartments of a
+geometry. Node coordinates and radii, parent nodes, segment IDs, compartment
+lengths / surface areas / volumes / centroids and tag
+bitmasks are numpy arrays, and the
+nodes and compartments are NodeView and CompartmentView objects: small
+__slots__ objects that read their properties from the arrays. This takes a
+fraction of the memory of Node and TwoNodeCompartment objects.
+  arrays: dict in the format of HocGeometry.getGeometryArrays() (only the
+    node, compartment, nodeSegment and nodeCompartment arrays are used)
+  segments: list of Segment objects, indexed by segment ID
+  store.nodes, store.compartments: lists of the views
+NOTE: the nodes and compartments can't be added, removed or reconnected
+  (node.segments and node.compartments are new lists on each access), but
+  branches, merged branches and path distances can be computed as usual.
+"""
+class GeometryStore(object):
+  # tags other than the segment name are bits of a uint64 mask
+  maxTags = 64
+  
+  def __init__(self, arrays, segments):
+    self.segments = segments
+    
+    # columns x, y, z, radius
+    self.nodeCoords = np.asarray(arrays['nodeCoords'], dtype=float)
+    self.compartmentNodes = np.asarray(arrays['compartmentNodes'])
+    self.compartmentSegments = np.asarray(arrays['compartmentSegments'])
+    self.nodeSegmentOffsets = np.asarray(arrays['nodeSegmentOffsets'])
+    self.nodeSegmentIndices = np.asarray(arrays['nodeSegments'])
+    self.nodeCompartmentOffsets = np.asarray(arrays['nodeCompartmentOffsets'])
+    self.nodeCompartmentIndices = np.asarray(arrays['nodeCompartments'])
+    numNodes = len(self.nodeCoords)
+    numCompartments = len(self.compartmentNodes)
+    
+    # the first segment of each node (-1 if it has none)
+    self.nodeSegments = np.full(numNodes, -1, dtype=np.int32)
+    hasSegment = np.diff(self.nodeSegmentOffsets) > 0
+    self.nodeSegments[hasSegment] = \
+      self.nodeSegmentIndices[self.nodeSegmentOffsets[:-1][hasSegment]]
+    # the parent of each node is node0 of the first compartment ending at it
+    # (-1 for nodes that start a segment)
+    self.nodeParents = np.full(numNodes, -1, dtype=np.int32)
+    ends, first = np.unique(self.compartmentNodes[:, 1], return_index=True)
+    self.nodeParents[ends] = self.compartmentNodes[first, 0]
+    
+    x, y, z, r = self.nodeCoords.T
+    n0, n1 = self.compartmentNodes.T
+    self.compartmentLengths, self.compartmentAreas, \
+      self.compartmentVolumes, self.compartmentCentroids = \
+      frustumGeometry(x[n0], y[n0], z[n0], r[n0], x[n1], y[n1], z[n1], r[n1])
+    
+    self.tagNames = []
+    self._tagBits = {}
+    self.nodeTags = np.zeros(numNodes, dtype=np.uint64)
+    self.compartmentTags = np.zeros(numCompartments, dtype=np.uint64)
+    
+    self.nodes = [NodeView(self, n) for n in range(numNodes)]
+    self.compartments = [CompartmentView(self, c)
+                         for c in range(numCompartments)]
+  
+  
+  def _tagBit(self, tag):
+    """
+    return the mask bit for tag, allocating one if necessary
+    """
+    bit = self._tagBits.get(tag)
+    if bit is None:
+      if len(self.tagNames) >= self.maxTags:
+        raise ValueError('GeometryStore can only hold %d tags, adding %s'
+                         % (self.maxTags, tag))
+      bit = 1 << len(self.tagNames)
+      self.tagNames.append(tag)
+      self._tagBits[tag] = bit
+    return bit
+  
+  
+  def _segmentName(self, segmentId):
+    return self.segments[segmentId].name if segmentId >= 0 else None
+
+
+
+class _TagSet(MutableSet):
+  """
+  Tags of a NodeView or CompartmentView: the name of its segment, plus the
+  tags whose bits are set in masks[index]
+  """
+  __slots__ = ('_store', '_masks', '_index', '_segmentName')
+  
+  def __init__(self, store, masks, index, segmentName):
+    self._store = store
+    self._masks = masks
+    self._index = index
+    self._segmentName = segmentName
+  
+  def __contains__(self, tag):
+    if tag == self._segmentName:
+      return True
+    bit = self._store._tagBits.get(tag)
+    return bit is not None and int(self._masks[self._index]) & bit != 0
+  
+  def __iter__(self):
+    if self._segmentName is not None:
+      yield self._segmentName
+    mask = int(self._masks[self._index])
+    for bit, tag in enumerate(self._store.tagNames):
+      if (mask >> bit) & 1 and tag != self._segmentName:
+        yield tag
+  
+  def __len__(self):
+    return sum(1 for tag in self)
+  
+  def __repr__(self):
+    return repr(set(self))
+  
+  def add(self, tag):
+    if tag != self._segmentName:
+      self._masks[self._index] = \
+        int(self._masks[self._index]) | self._store._tagBit(tag)
+  
+  def discard(self, tag):
+    if tag == self._segmentName:
+      raise ValueError("Can't remove segment name from tags")
+    bit = self._store._tagBits.get(tag)
+    if bit is not None:
+      self._masks[self._index] = int(self._masks[self._index]) & ~bit
+  
+  def update(self, *tagLists):
+    for tags in tagLists:
+      for tag in tags:
+        self.add(tag)
+
+
+
+"""
+class NodeView
+A spherical Node whose data is stored in a GeometryStore
+"""
+class NodeView(object):
+  __slots__ = ('_store', '_index')
+  theta = 0.0
+  phi = 0.0
+  surface_area = None
+  volume = None
+  
+  def __init__(self, store, index):
+    self._store = store
+    self._index = index
+  
+  @property
+  def x(self):
+    return float(self._store.nodeCoords[self._index, 0])
+  
+  @property
+  def y(self):
+    return float(self._store.nodeCoords[self._index, 1])
+  
+  @property
+  def z(self):
+    return float(self._store.nodeCoords[self._index, 2])
+  
+  @property
+  def r1(self):
+    return float(self._store.nodeCoords[self._index, 3])
+  
+  r2 = r1
+  r3 = r1
+  
+  @property
+  def parent(self):
+    """
+    return the previous node in this node's segment, or None
+    """
+    parent = int(self._store.nodeParents[self._index])
+    return self._store.nodes[parent] if parent >= 0 else None
+  
+  @property
+  def compartments(self):
+    store = self._store
+    offsets = store.nodeCompartmentOffsets
+    return [store.compartments[c] for c in
+            store.nodeCompartmentIndices[offsets[self._index]:
+                                         offsets[self._index+1]].tolist()]
+  
+  @property
+  def segments(self):
+    store = self._store
+    offsets = store.nodeSegmentOffsets
+    return [store.segments[s] for s in
+            store.nodeSegmentIndices[offsets[self._index]:
+                                     offsets[self._index+1]].tolist()]
+  
+  @property
+  def tags(self):
+    store = self._store
+    return _TagSet(store, store.nodeTags, self._index,
+                   store._segmentName(int(store.nodeSegments[self._index])))
+  
+  maxRadius = Node.maxRadius
+  minRadius = Node.minRadius
+  avgRadius = Node.avgRadius
+  getElipse = Node.getElipse
+
+
+
+"""
+class CompartmentView
+A TwoNodeCompartment whose data is stored in a GeometryStore
+"""
+class CompartmentView(Compartment):
+  __slots__ = ('_store', '_index')
+  name = None
+  theta0 = 0.0
+  theta1 = 0.0
+  
+  def __init__(self, store, index):
+    self._store = store
+    self._index = index
+  
+  def _nodeCoord(self, end, column):
+    store = self._store
+    return float(store.nodeCoords[store.compartmentNodes[self._index, end],
+                                  column])
+  
+  @property
+  def nodes(self):
+    store = self._store
+    n0, n1 = store.compartmentNodes[self._index].tolist()
+    return [store.nodes[n0], store.nodes[n1]]
+  
+  @property
+  def segment(self):
+    return self._store.segments[int(self._store.compartmentSegments[
+      self._index])]
+  
+  @property
+  def tags(self):
+    store = self._store
+    return _TagSet(store, store.compartmentTags, self._index,
+                   store._segmentName(int(store.compartmentSegments[
+                     self._index])))
+  
+  @property
+  def length(self):
+    return float(self._store.compartmentLengths[self._index])
+  
+  @property
+  def surfaceArea(self):
+    return float(self._store.compartmentAreas[self._index])
+  
+  @property
+  def volume(self):
+    return float(self._store.compartmentVolumes[self._index])
+  
+  @property
+  def centroid(self):
+    return tuple(self._store.compartmentCentroids[self._index].tolist())
+  
+  x0 = property(lambda self: self._nodeCoord(0, 0))
+  y0 = property(lambda self: self._nodeCoord(0, 1))
+  z0 = property(lambda self: self._nodeCoord(0, 2))
+  x1 = property(lambda self: self._nodeCoord(1, 0))
+  y1 = property(lambda self: self._nodeCoord(1, 1))
+  z1 = property(lambda self: self._nodeCoord(1, 2))
+  # nodes are spherical
+  semiMajor0 = property(lambda self: self._nodeCoord(0, 3))
+  semiMinor0 = semiMajor0
+  semiMajor1 = property(lambda self: self._nodeCoord(1, 3))
+  semiMinor1 = semiMajor1
+  
+  node0 = TwoNodeCompartment.node0
+  node1 = TwoNodeCompartment.node1
+  neighbors = TwoNodeCompartment.neighbors
+  lengthPerArea = TwoNodeCompartment.lengthPerArea
+  avgRadius = TwoNodeCompartment.avgRadius
@@ -0,0 +1,315 @@
+#!/usr/bin/python
+
+
+
+_usageStr=\
+"""usage: neuron_benchmarks.py benchmark
+  time geometry loading and analysis on synthetic .hoc files
+  benchmark is one of:
+    loading        HocGeometry load time as the number of filaments grows
+    pathDistances  PathDistanceFinder legacy vs dijkstra vs auto engine,
+                   with and without loops
+    memory         bytes per node of geometries built from geometry arrays,
+                   with Node objects vs a compact GeometryStore
+    aggregates     Geometry.subtreeAggregates time, with and without loops
+"""
+
+
+
+import os, sys, gc, time, math, random, tempfile, tracemalloc
+from neuron_readExportedGeometry import *
+
+
+
+def writeSyntheticHoc(fileName, numFilaments, pointsPerFilament=4, seed=0,
+                      numLoops=0):
+  """
+  Write an Imaris-style .hoc file describing a random tree of numFilaments
+  dendrite[N] filaments, rooted at a thick soma filament (dendrite[0]).
+  Each child filament starts at the end point of its parent, and is attached
+  with "connect child(0), parent(1)"
+  If numLoops > 0, add that many extra filaments, each bridging the end points
+  of two random filaments to form a loop
+  """
+  rand = random.Random(seed)
+  blocks = []
+  connects = []
+  ends = []
+  for n in range(numFilaments):
+    if n == 0:
+      # the soma
+      points = [(100.0 + p, 100.0, 10.0, 20.0 if 2*p == pointsPerFilament
+                 else 10.0) for p in range(pointsPerFilament)]
+    else:
+      # prefer recent parents, so the tree is deep as well as bushy
+      parent = rand.randrange(max(0, n - 8), n)
+      x, y, z, d = ends[parent]
+      angle = 2 * math.pi * rand.random()
+      points = [(x, y, z, d)]
+      for p in range(1, pointsPerFilament):
+        x += 3.0 * math.cos(angle) + rand.random()
+        y += 3.0 * math.sin(angle) + rand.random()
+        z += rand.random() - 0.5
+        d = max(0.25, 0.98 * d)
+        points.append((round(x, 3), round(y, 3), round(z, 3), round(d, 3)))
+      connects.append('connect dendrite[%d](0), dendrite[%d](1)'
+                      % (n, parent))
+    ends.append(points[-1])
+    blocks.append(points)
+
+  while numLoops > 0 and numFilaments > 2:
+    n = len(blocks)
+    end0, end1 = rand.sample(range(1, numFilaments), 2)
+    p0, p1 = ends[end0], ends[end1]
+    points = [p0]
+    for p in range(1, pointsPerFilament - 1):
+      t = p / (pointsPerFilament - 1.0)
+      # bow the bridge slightly so it isn't perfectly straight
+      points.append(tuple(round(c0 + t * (c1 - c0) + (0.7 if i < 2 else 0), 3)
+                          for i, (c0, c1) in enumerate(zip(p0[:3], p1[:3])))
+                    + (min(p0[3], p1[3]),))
+    points.append(p1)
+    blocks.append(points)
+    connects.append('connect dendrite[%d](0), dendrite[%d](1)' % (n, end0))
+    connects.append('connect dendrite[%d](1), dendrite[%d](1)' % (n, end1))
+    numLoops -= 1
+
+  with open(fileName, 'w') as fOut:
+    fOut.write('create dendrite[%d]\n' % len(blocks))
+    for n, points in enumerate(blocks):
+      fOut.write('dendrite[%d] {\n  pt3dclear()\n' % n)
+      fOut.writelines('  pt3dadd(%g, %g, %g, %g)\n' % p for p in points)
+      fOut.write('}\n')
+    fOut.writelines(c + '\n' for c in connects)
+
+
+def _bestTime(func, repeats=3):
+  """
+  return (shortest run time, result) of repeats calls to func(), collecting
+  garbage before each call so earlier runs don't add to the timing
+  """
+  bestTime = float('inf')
+  for n in range(repeats):
+    gc.collect()
+    startTime = time.perf_counter()
+    result = func()
+    bestTime = min(bestTime, time.perf_counter() - startTime)
+  return bestTime, result
+
+
+def benchmarkLoading(filamentCounts=(2500, 5000, 10000, 20000),
+                     pointsPerFilament=4, fastRead=True):
+  """
+  Time HocGeometry loading (reading, building objects and connecting
+  filaments) on synthetic files with increasing numbers of filaments.
+  Loading scales linearly if the time per filament stays roughly constant.
+  return list of (numFilaments, seconds)
+  """
+  results = []
+  print('%12s %10s %14s %18s'
+        % ('filaments', 'nodes', 'load time (s)', 'us per filament'))
+  with tempfile.TemporaryDirectory() as tempDir:
+    for numFilaments in filamentCounts:
+      fileName = os.path.join(tempDir, 'synthetic%d.hoc' % numFilaments)
+      writeSyntheticHoc(fileName, numFilaments, pointsPerFilament)
+      startTime = time.perf_counter()
+      geometry = HocGeometry(fileName, fastRead=fastRead)
+      # make sure lazily-built objects are included in the timing
+      numNodes = len(geometry.nodes)
+      loadTime = time.perf_counter() - startTime
+      print('%12d %10d %14.3f %18.1f' % (numFilaments, numNodes, loadTime,
+                                         1.0e6 * loadTime / numFilaments))
+      results.append((numFilaments, loadTime))
+  return results
+
+
+
+def benchmarkPathDistances(filamentCounts=(1000, 2000, 4000),
+                           loopFractions=(0.0, 0.02), pointsPerFilament=4):
+  """
+  Time PathDistanceFinder from the soma with each engine (legacy, dijkstra,
+  and auto, which uses a tree traversal when there are no loops), on
+  loop-free and looped synthetic morphologies, and check that the engines
+  find the same distances to every segment.
+  return list of (numFilaments, loopFraction, {engine : seconds})
+  """
+  engines = ('legacy', 'dijkstra', 'auto')
+  results = []
+  print('%10s %6s %11s %13s %9s %9s' % ('filaments', 'loops', 'legacy (s)',
+                                         'dijkstra (s)', 'auto (s)',
+                                         'speedup'))
+  with tempfile.TemporaryDirectory() as tempDir:
+    for numFilaments in filamentCounts:
+      for loopFraction in loopFractions:
+        numLoops = int(round(loopFraction * numFilaments))
+        fileName = os.path.join(tempDir, 'synthetic%d_%d.hoc'
+                                % (numFilaments, numLoops))
+        writeSyntheticHoc(fileName, numFilaments, pointsPerFilament,
+                          numLoops=numLoops)
+        geometry = HocGeometry(fileName, fastRead=True)
+        soma = geometry.soma
+        times = {}
+        finders = {}
+        for engine in engines:
+          times[engine], finders[engine] = _bestTime(
+            lambda: PathDistanceFinder(geometry, soma, engine=engine))
+        for segment in geometry.segments:
+          d0 = finders['legacy'].distanceTo(segment)
+          for engine in engines[1:]:
+            d1 = finders[engine].distanceTo(segment)
+            if abs(d0 - d1) > 1.0e-9 * max(1.0, d0):
+              raise AssertionError('%s engine disagrees about distance to %s:'
+                                   ' %g, %g' % (engine, segment.name, d0, d1))
+        print('%10d %6d %11.3f %13.3f %9.3f %9.1f'
+              % (numFilaments, numLoops, times['legacy'], times['dijkstra'],
+                 times['auto'], times['legacy'] / times['auto']))
+        results.append((numFilaments, loopFraction, times))
+  return results
+
+
+
+def _tracedBytes(func):
+  """
+  return (bytes allocated by func() and still in use afterwards, result)
+  """
+  gc.collect()
+  tracemalloc.start()
+  try:
+    result = func()
+    gc.collect()
+    usedBytes = tracemalloc.get_traced_memory()[0]
+  finally:
+    tracemalloc.stop()
+  return usedBytes, result
+
+
+def benchmarkMemory(filamentCounts=(1000, 4000, 16000),
+                    pointCounts=(4, 16)):
+  """
+  Measure the memory held by geometries rebuilt with
+  HocGeometry.fromGeometryArrays(), with Node/TwoNodeCompartment objects and
+  with a compact GeometryStore, and check that both give the same path
+  distances. The geometry arrays are copied inside the measurement, because
+  the compact geometry keeps using them. Segments are ordinary objects in
+  both cases, so the saving grows with the number of points per filament.
+  return list of (numFilaments, pointsPerFilament, numNodes, bytes per node,
+    compact bytes per node)
+  """
+  def _build(arrays, compact):
+    arrays = {key : array.copy() for key, array in arrays.items()}
+    geometry = HocGeometry.fromGeometryArrays(arrays, compact=compact)
+    # build the objects, and the branches derived from them
+    geometry.findBranches()
+    return geometry
+  
+  results = []
+  print('%10s %7s %9s %16s %16s %7s'
+        % ('filaments', 'points', 'nodes', 'bytes per node', 'compact (bytes)',
+           'ratio'))
+  with tempfile.TemporaryDirectory() as tempDir:
+    for numFilaments, pointsPerFilament in [(f, p) for p in pointCounts
+                                            for f in filamentCounts]:
+      fileName = os.path.join(tempDir, 'synthetic%d_%d.hoc'
+                              % (numFilaments, pointsPerFilament))
+      writeSyntheticHoc(fileName, numFilaments, pointsPerFilament)
+      geometry = HocGeometry(fileName, fastRead=True)
+      geometry.checkConnectivity(removeDisconnected=True, debugInfo=False)
+      arrays = geometry.getGeometryArrays()
+      del geometry
+      
+      usedBytes, geometry = _tracedBytes(lambda: _build(arrays, False))
+      numNodes = len(geometry.nodes)
+      distances = PathDistanceFinder(geometry, geometry.soma).distancesTo(
+        geometry.segments)
+      del geometry
+      compactBytes, geometry = _tracedBytes(lambda: _build(arrays, True))
+      compactDistances = PathDistanceFinder(
+        geometry, geometry.soma).distancesTo(geometry.segments)
+      if (distances != compactDistances).any():
+        raise AssertionError('Compact geometry has different path distances')
+      del geometry
+      
+      print('%10d %7d %9d %16.0f %16.0f %7.1f'
+            % (numFilaments, pointsPerFilament, numNodes,
+               usedBytes / float(numNodes), compactBytes / float(numNodes),
+               usedBytes / float(compactBytes)))
+      results.append((numFilaments, pointsPerFilament, numNodes,
+                      usedBytes / float(numNodes),
+                      compactBytes / float(numNodes)))
+  return results
+
+
+
+def benchmarkAggregates(filamentCounts=(1000, 4000, 16000),
+                        loopFractions=(0.0, 0.02), pointsPerFilament=4):
+  """
+  Time Geometry.subtreeAggregates on loop-free and looped synthetic
+  morphologies, and check that the soma branch totals are the whole-neuron
+  sums: totalCableLength(), the total surface area and volume, and the number
+  of segments (other than the soma) with neighbors at only one end.
+  return list of (numFilaments, loopFraction, seconds)
+  """
+  results = []
+  print('%10s %6s %9s %8s' % ('filaments', 'loops', 'tips', 'time (s)'))
+  with tempfile.TemporaryDirectory() as tempDir:
+    for numFilaments in filamentCounts:
+      for loopFraction in loopFractions:
+        numLoops = int(round(loopFraction * numFilaments))
+        fileName = os.path.join(tempDir, 'synthetic%d_%d.hoc'
+                                % (numFilaments, numLoops))
+        writeSyntheticHoc(fileName, numFilaments, pointsPerFilament,
+                          numLoops=numLoops)
+        geometry = HocGeometry(fileName, fastRead=True)
+        geometry.findBranches()
+        aggTime, aggregates = _bestTime(geometry.subtreeAggregates)
+        
+        soma = geometry.soma
+        numEnds = sum(1 for segment in geometry.segments
+                      if segment is not soma and
+                      len({loc for loc, nLoc, node
+                           in segment.neighborLocations}) <= 1)
+        somaInd = geometry.branches.index(geometry.somaBranch)
+        expected = {
+          'cableLength' : geometry.totalCableLength(),
+          'surfaceArea' : sum(b.surfaceArea for b in geometry.branches),
+          'volume' : sum(b.volume for b in geometry.branches),
+          'numTips' : numEnds
+        }
+        for key, total in expected.items():
+          somaTotal = aggregates[key][somaInd]
+          if abs(somaTotal - total) > 1.0e-9 * max(1.0, abs(total)):
+            raise AssertionError('Soma branch %s is %g, but the neuron has %g'
+                                 % (key, somaTotal, total))
+        
+        print('%10d %6d %9d %8.3f' % (numFilaments, numLoops, numEnds,
+                                      aggTime))
+        results.append((numFilaments, loopFraction, aggTime))
+  return results
+
+
+
+###############################################################################
+_benchmarks = {
+  'loading' : benchmarkLoading,
+  'pathDistances' : benchmarkPathDistances,
+  'memory' : benchmarkMemory,
+  'aggregates' : benchmarkAggregates
+}
+
+
+def _parseArguments():
+  arguments = sys.argv
+
+  if len(arguments) != 2 or arguments[1] not in _benchmarks:
+    print(_usageStr)
+    raise TypeError('Incorrect arguments.')
+
+  return arguments[1]
+
+
+
+###############################################################################
+if __name__ == "__main__":
+  benchmark = _parseArguments()
+  _benchmarks[benchmark]()
+  sys.exit(0)
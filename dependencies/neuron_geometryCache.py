@@ -0,0 +1,216 @@
+#!/usr/bin/python
+
+
+
+_usageStr=\
+"""usage: neuron_geometryCache.py [clear]
+  display (or clear) the contents of the on-disk geometry cache
+  the cache directory is $NEURAL_HEATMAP_CACHE, or ~/.cache/neural-heatmap
+"""
+
+
+
+import os, sys, hashlib, tempfile, zipfile
+import numpy as np
+from neuron_readExportedGeometry import *
+
+
+
+_defaultCacheDir = os.environ.get(
+  'NEURAL_HEATMAP_CACHE',
+  os.path.join(os.path.expanduser('~'), '.cache', 'neural-heatmap'))
+_defaultMaxBytes = 1024**3
+_defaultCache = None
+
+
+def getDefaultCache():
+  """
+  return the GeometryCache shared by demoReadsilent(..., cache=True)
+  """
+  global _defaultCache
+  if _defaultCache is None:
+    _defaultCache = GeometryCache()
+  return _defaultCache
+
+
+def _removeFile(fileName):
+  # remove fileName if possible; another process sharing the cache may
+  #  already have removed it, or (on Windows) still have it open
+  try:
+    os.remove(fileName)
+  except OSError:
+    pass
+
+
+def _hashFile(fileName, blockSize=1 << 20):
+  """
+  return hex digest of the contents of fileName
+  """
+  digest = hashlib.sha1()
+  with open(fileName, 'rb') as fIn:
+    for block in iter(lambda: fIn.read(blockSize), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+
+"""
+class GeometryCache
+Stores parsed, connected and connectivity-checked geometries as compressed
+.npz files (one per .hoc file), keyed by the hash of the .hoc contents and
+HocGeometry.parserVersion. Loading a cached geometry skips text parsing,
+_connectFilaments and checkConnectivity.
+When the cache grows beyond maxBytes, the least recently used files are
+evicted.
+"""
+class GeometryCache(object):
+  def __init__(self, cacheDir=None, maxBytes=_defaultMaxBytes):
+    self.cacheDir = cacheDir if cacheDir is not None else _defaultCacheDir
+    self.maxBytes = maxBytes
+    self.hits = 0
+    self.misses = 0
+
+
+  def cacheFile(self, fileName):
+    """
+    return name of the file that caches the geometry read from fileName
+    """
+    return os.path.join(self.cacheDir, '%s-v%d.npz'
+                        % (_hashFile(fileName), HocGeometry.parserVersion))
+
+
+  def load(self, fileName, fastRead=True, compact=False):
+    """
+    return HocGeometry read from fileName, using the cached copy if there is
+    one, and adding it to the cache otherwise
+    if compact is True, the geometry keeps its nodes and compartments in a
+      GeometryStore
+    """
+    cacheFile = self.cacheFile(fileName)
+    arrays = self._readCacheFile(cacheFile)
+    if arrays is not None:
+      self.hits += 1
+      return HocGeometry.fromGeometryArrays(arrays, fileName, compact=compact)
+
+    self.misses += 1
+    geometry = HocGeometry(fileName, fastRead=fastRead)
+    geometry.checkConnectivity(removeDisconnected=True)
+    arrays = geometry.getGeometryArrays()
+    self._writeCacheFile(cacheFile, arrays)
+    if compact:
+      return HocGeometry.fromGeometryArrays(arrays, fileName, compact=True)
+    return geometry
+
+
+  def clear(self):
+    """
+    remove all cached geometries
+    """
+    for cacheFile, size, lastUsed in self._cacheFiles():
+      _removeFile(cacheFile)
+
+
+  def _readCacheFile(self, cacheFile):
+    """
+    return dict of arrays stored in cacheFile, or None if it's not usable
+    """
+    if not os.path.isfile(cacheFile):
+      return None
+    try:
+      with np.load(cacheFile) as npz:
+        arrays = {key : npz[key] for key in npz.files}
+    except FileNotFoundError:
+      # another process evicted it
+      return None
+    except (IOError, ValueError, zipfile.BadZipFile) as err:
+      warn('Discarding unreadable cached geometry', '%s: %s'
+           % (cacheFile, err))
+      _removeFile(cacheFile)
+      return None
+    # mark cacheFile as recently used
+    try:
+      os.utime(cacheFile)
+    except OSError:
+      pass
+    return arrays
+
+
+  def _writeCacheFile(self, cacheFile, arrays):
+    """
+    atomically write arrays to cacheFile, then evict old files if necessary
+    """
+    os.makedirs(self.cacheDir, exist_ok=True)
+    fd, tempName = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as fOut:
+        np.savez_compressed(fOut, **arrays)
+      os.replace(tempName, cacheFile)
+    except:
+      os.remove(tempName)
+      raise
+    self._evict(keep=cacheFile)
+
+
+  def _cacheFiles(self):
+    """
+    return list of (fileName, size, lastUsed) for every cached geometry
+    """
+    try:
+      names = os.listdir(self.cacheDir)
+    except FileNotFoundError:
+      return []
+    cacheFiles = []
+    for name in names:
+      if not name.endswith('.npz'):
+        continue
+      cacheFile = os.path.join(self.cacheDir, name)
+      try:
+        stat = os.stat(cacheFile)
+      except FileNotFoundError:
+        # removed by another process since listdir
+        continue
+      cacheFiles.append((cacheFile, stat.st_size, stat.st_mtime))
+    return cacheFiles
+
+
+  def _evict(self, keep=None):
+    """
+    remove least recently used cache files until the cache fits in maxBytes
+    """
+    cacheFiles = self._cacheFiles()
+    totalBytes = sum(size for cacheFile, size, lastUsed in cacheFiles)
+    cacheFiles.sort(key=lambda x: x[2])
+    for cacheFile, size, lastUsed in cacheFiles:
+      if totalBytes <= self.maxBytes:
+        break
+      if cacheFile == keep:
+        continue
+      _removeFile(cacheFile)
+      totalBytes -= size
+
+
+
+###############################################################################
+def _parseArguments():
+  arguments = sys.argv
+
+  if len(arguments) > 2 or (len(arguments) == 2 and arguments[1] != 'clear'):
+    print(_usageStr)
+    raise TypeError('Incorrect arguments.')
+
+  return len(arguments) == 2
+
+
+
+###############################################################################
+if __name__ == "__main__":
+  doClear = _parseArguments()
+  cache = getDefaultCache()
+  cacheFiles = cache._cacheFiles()
+  print('%s: %d cached geometries, %.1f MB'
+        % (cache.cacheDir, len(cacheFiles),
+           sum(size for f, size, t in cacheFiles) / 1024.0**2))
+  if doClear:
+    cache.clear()
+    print('Cleared cache')
+  sys.exit(0)
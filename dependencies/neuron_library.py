@@ -0,0 +1,302 @@
+#!/usr/bin/python
+
+
+
+_usageStr=\
+"""usage: neuron_library.py ingest libraryFile hocFileOrDir [hocFileOrDir ...]
+       neuron_library.py list libraryFile
+  ingest: parse .hoc files and pack them into one memory-mappable library
+  list: display the neurons stored in a library
+"""
+
+
+
+import os, sys, json, shutil, tempfile
+import numpy as np
+from neuron_readExportedGeometry import *
+
+
+
+"""
+Library file layout (all numbers little-endian):
+  8 bytes    magic, b'NRNLIB01'
+  8 bytes    uint64 length of the JSON header
+  header     JSON: formatVersion, parserVersion, numNeurons, and for each
+             column (one per key of HocGeometry.getGeometryArrays(), plus
+             'sourceFile'): dtype, trailing shape, kind, and the byte
+             positions of its offsets table and data
+  columns    for each column, 64-byte aligned:
+               offsets: int64[numNeurons + 1], rows of neuron n are
+                 data[offsets[n]:offsets[n+1]]
+               data: the rows of every neuron, concatenated
+Columns have one of four kinds:
+  'array'   numeric array, rows along the first axis
+  'scalar'  numeric 0-d array, stored as one row per neuron
+  'strings' 1-d string array, stored as utf-8 bytes with each string
+            terminated by a newline
+  'string'  0-d string array, stored like 'strings'
+"""
+_magic = b'NRNLIB01'
+_formatVersion = 1
+_alignment = 64
+
+
+def _columnKind(array):
+  if array.dtype.kind == 'U':
+    return 'string' if array.ndim == 0 else 'strings'
+  elif array.ndim == 0:
+    return 'scalar'
+  else:
+    return 'array'
+
+
+def _encodeStrings(array):
+  return ''.join(s + '\n' for s in np.atleast_1d(array).tolist()) \
+           .encode('utf-8')
+
+
+def _decodeStrings(data, kind):
+  strings = data.tobytes().decode('utf-8').split('\n')[:-1]
+  if kind == 'string':
+    return np.array(strings[0])
+  return np.array(strings, dtype=str)
+
+
+def ingestLibrary(libraryFile, hocFiles, fastRead=True):
+  """
+  Parse hocFiles (and connect them and check their connectivity), packing
+  their geometry arrays into libraryFile. Each column is streamed through a
+  temporary file, so memory use doesn't grow with the number of neurons.
+  return list of files that could not be ingested
+  """
+  tempDir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(libraryFile)))
+  try:
+    columns = None
+    failed = []
+    numNeurons = 0
+    for hocFile in hocFiles:
+      try:
+        geometry = HocGeometry(hocFile, fastRead=fastRead)
+        geometry.checkConnectivity(removeDisconnected=True, debugInfo=False)
+        arrays = geometry.getGeometryArrays()
+      except Exception as err:
+        warn('Could not ingest %s' % hocFile, str(err))
+        failed.append(hocFile)
+        continue
+      arrays['sourceFile'] = np.array(os.path.abspath(hocFile))
+
+      if columns is None:
+        # describe the columns using the first neuron
+        columns = {}
+        for key in sorted(arrays.keys()):
+          array = arrays[key]
+          kind = _columnKind(array)
+          columns[key] = {
+            'kind' : kind,
+            'dtype' : 'u1' if kind in ('string', 'strings')
+                      else array.dtype.str,
+            'shape' : list(array.shape[1:]) if kind == 'array' else [],
+            'offsets' : [0],
+            'tempFile' : open(os.path.join(tempDir, key), 'wb')
+          }
+
+      for key, column in columns.items():
+        array = arrays[key]
+        if column['kind'] in ('string', 'strings'):
+          data = np.frombuffer(_encodeStrings(array), dtype='u1')
+        else:
+          data = np.ascontiguousarray(array, dtype=column['dtype'])
+          if column['kind'] == 'scalar':
+            data = data.reshape(1)
+          else:
+            data = data.reshape([-1] + column['shape'])
+        column['tempFile'].write(data.tobytes())
+        column['offsets'].append(column['offsets'][-1] + len(data))
+      numNeurons += 1
+
+    if columns is None:
+      raise IOError('No neurons could be ingested')
+
+    # lay out the file: header, then offsets + data for each column
+    def _align(pos):
+      return pos + (-pos) % _alignment
+
+    def _header(dataStart):
+      pos = dataStart
+      for key in sorted(columns.keys()):
+        column = columns[key]
+        column['offsetsStart'] = pos
+        pos = _align(pos + 8 * (numNeurons + 1))
+        column['dataStart'] = pos
+        column['tempFile'].flush()
+        pos = _align(pos + os.path.getsize(column['tempFile'].name))
+      return json.dumps({
+        'formatVersion' : _formatVersion,
+        'parserVersion' : HocGeometry.parserVersion,
+        'numNeurons' : numNeurons,
+        'columns' : {key : {k : column[k] for k in
+                            ('kind', 'dtype', 'shape', 'offsetsStart',
+                             'dataStart')}
+                     for key, column in columns.items()}
+      }).encode('utf-8')
+
+    # the header contains the column positions, which depend on the header
+    # length, so size the header for positions with more digits than needed
+    headerLen = len(_header(10**15))
+    dataStart = _align(len(_magic) + 8 + headerLen)
+    header = _header(dataStart).ljust(headerLen)
+
+    with open(libraryFile, 'wb') as fOut:
+      fOut.write(_magic)
+      fOut.write(np.array(len(header), dtype='<u8').tobytes())
+      fOut.write(header)
+      for key in sorted(columns.keys()):
+        column = columns[key]
+        column['tempFile'].close()
+        fOut.write(b'\0' * (column['offsetsStart'] - fOut.tell()))
+        fOut.write(np.array(column['offsets'], dtype='<i8').tobytes())
+        fOut.write(b'\0' * (column['dataStart'] - fOut.tell()))
+        with open(column['tempFile'].name, 'rb') as fIn:
+          shutil.copyfileobj(fIn, fOut)
+
+    return failed
+  finally:
+    if columns is not None:
+      for column in columns.values():
+        column['tempFile'].close()
+    shutil.rmtree(tempDir)
+
+
+
+"""
+class NeuronLibrary
+Random access to the neurons packed in a library file by ingestLibrary().
+The file is memory-mapped, so opening a neuron only reads the pages holding
+that neuron's rows.
+  len(library), library.names, library.index(name)
+  library[n] or library.open(n) returns a HocGeometry
+"""
+class NeuronLibrary(object):
+  def __init__(self, libraryFile):
+    self.fileName = libraryFile
+    self._map = np.memmap(libraryFile, dtype='u1', mode='r')
+    if self._map[:len(_magic)].tobytes() != _magic:
+      raise IOError('%s is not a neuron library' % libraryFile)
+    headerLen = int(self._map[len(_magic):len(_magic) + 8].view('<u8')[0])
+    headerStart = len(_magic) + 8
+    self.header = json.loads(
+      self._map[headerStart:headerStart + headerLen].tobytes().decode('utf-8'))
+    if self.header['formatVersion'] != _formatVersion:
+      raise IOError('%s has unsupported format version %d'
+                    % (libraryFile, self.header['formatVersion']))
+    if self.header['parserVersion'] != HocGeometry.parserVersion:
+      warn('%s was ingested with an older hoc parser' % libraryFile,
+           're-ingest to pick up parser changes')
+    self.numNeurons = self.header['numNeurons']
+
+    # views of the columns (no data is read until it is used)
+    self._columns = {}
+    for key, column in self.header['columns'].items():
+      offsetsStart = column['offsetsStart']
+      offsets = self._map[offsetsStart:offsetsStart + 8*(self.numNeurons+1)] \
+                  .view('<i8')
+      dtype = np.dtype(column['dtype'])
+      rowSize = dtype.itemsize * int(np.prod(column['shape']))
+      dataStart = column['dataStart']
+      data = self._map[dataStart:dataStart + rowSize * int(offsets[-1])] \
+               .view(dtype).reshape([-1] + column['shape'])
+      self._columns[key] = (column['kind'], offsets, data)
+    self._names = None
+
+
+  def __len__(self):
+    return self.numNeurons
+
+
+  def __getitem__(self, index):
+    return self.open(index)
+
+
+  def __iter__(self):
+    for index in range(self.numNeurons):
+      yield self.open(index)
+
+
+  @property
+  def names(self):
+    """
+    list of the names of the neurons in the library
+    """
+    if self._names is None:
+      self._names = [str(self._getArray('name', n))
+                     for n in range(self.numNeurons)]
+    return self._names
+
+
+  def index(self, name):
+    """
+    return index of the neuron with the requested name
+    """
+    return self.names.index(name)
+
+
+  def getGeometryArrays(self, index):
+    """
+    return dict of (memory-mapped) geometry arrays for neuron index
+    """
+    if index < 0:
+      index += self.numNeurons
+    if not 0 <= index < self.numNeurons:
+      raise IndexError('Library has %d neurons' % self.numNeurons)
+    return {key : self._getArray(key, index) for key in self._columns}
+
+
+  def open(self, index, compact=False):
+    """
+    return HocGeometry for neuron index, built from memory-mapped arrays
+    if compact is True, keep nodes and compartments in a GeometryStore, so
+      that many neurons can be open at once
+    """
+    arrays = self.getGeometryArrays(index)
+    sourceFile = str(arrays.pop('sourceFile'))
+    return HocGeometry.fromGeometryArrays(arrays, sourceFile, compact=compact)
+
+
+  def _getArray(self, key, index):
+    kind, offsets, data = self._columns[key]
+    start, stop = int(offsets[index]), int(offsets[index + 1])
+    if kind in ('string', 'strings'):
+      return _decodeStrings(data[start:stop], kind)
+    elif kind == 'scalar':
+      return data[start]
+    else:
+      return data[start:stop]
+
+
+
+###############################################################################
+def _parseArguments():
+  arguments = sys.argv
+
+  if len(arguments) >= 4 and arguments[1] == 'ingest':
+    return arguments[1], arguments[2], arguments[3:]
+  elif len(arguments) == 3 and arguments[1] == 'list':
+    return arguments[1], arguments[2], []
+  print(_usageStr)
+  raise TypeError('Incorrect arguments.')
+
+
+
+###############################################################################
+if __name__ == "__main__":
+  command, libraryFile, paths = _parseArguments()
+  if command == 'ingest':
+    hocFiles = findHocFiles(paths)
+    failed = ingestLibrary(libraryFile, hocFiles)
+    print('Ingested %d of %d neurons into %s'
+          % (len(hocFiles) - len(failed), len(hocFiles), libraryFile))
+  else:
+    library = NeuronLibrary(libraryFile)
+    for n, name in enumerate(library.names):
+      print('%6d %s' % (n, name))
+  sys.exit(0)
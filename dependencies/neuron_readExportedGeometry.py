@@ -9,34 +9,120 @@ _usageStr=\
 
 
 
-import os, sys, re, math
+import os, sys, re, math, gc
+from contextlib import contextmanager
+from itertools import chain
 from NeuronGeometry import *
 import numpy as np
 import networkx as nx
 
 
 
+# regular expressions used by the bulk (fastRead) hoc reader
+_hocBlockEndRe = re.compile(r'^[ \t]*\}[ \t]*\r?$', re.M)
+_pt3daddRe = re.compile(r'^[ \t]*pt3dadd\(([^)\n]*)\)', re.M)
+_pt3dclearRe = re.compile(r'^[ \t]*pt3dclear\b', re.M)
+_nonBlankLineRe = re.compile(r'^[ \t]*\S', re.M)
+
+
+@contextmanager
+def _pausedGarbageCollection():
+  """
+  Disable the cyclic garbage collector while building many linked objects.
+  Otherwise full collections are repeatedly triggered by the growing object
+  graph, and loading large files takes time quadratic in their size.
+  """
+  wasEnabled = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if wasEnabled:
+      gc.enable()
+
+
+def _materializedList(name):
+  """
+  Return a property for the Geometry list attribute name. When a HocGeometry
+  is read in fastRead mode (or from geometry arrays), the list is only built
+  the first time it is accessed.
+  """
+  privateName = '_' + name
+  def _get(self):
+    if self._buildPending:
+      self._buildPendingObjects()
+    return getattr(self, privateName)
+  def _set(self, value):
+    setattr(self, privateName, value)
+  return property(_get, _set)
+
+
+def _raggedArrays(lists):
+  """
+  Pack a list of lists of integers into (offsets, values) numpy arrays, so
+  that lists[n] == values[offsets[n]:offsets[n+1]]
+  """
+  offsets = np.zeros(len(lists) + 1, dtype=int)
+  np.cumsum([len(l) for l in lists], out=offsets[1:])
+  values = np.fromiter(chain.from_iterable(lists), dtype=int,
+                       count=offsets[-1])
+  return offsets, values
+
+
+
 class HocGeometry(Geometry):
-  def __init__(self, _fileName=None):
+  # increment whenever a change to reading/connecting alters the geometry, so
+  # that cached geometries are not reused
+  parserVersion = 1
+  
+  nodes = _materializedList('nodes')
+  segments = _materializedList('segments')
+  compartments = _materializedList('compartments')
+  
+  def __init__(self, _fileName=None, fastRead=False):
+    self._buildPending = False
     Geometry.__init__(self)
     self._openFilament = None
     self._connections = []
     self.connections = []
     self._filamentNames = []
+    # map from filament name to filament index, kept in sync with
+    # self._filamentNames and self._filaments
+    self._filamentIndices = {}
     self._filaments = {}
     self._filamentNameType = None
     self._warnRepeatFilaments = True
+    # numpy node/edge arrays, only produced by the fastRead reader
+    self.hocArrays = None
+    # arrays describing an already-connected geometry, see
+    # fromGeometryArrays()
+    self._geometryArrays = None
+    # GeometryStore holding the nodes and compartments, if built compact
+    self._compact = False
+    self.store = None
     
     if _fileName is not None:
       self.setFileName(_fileName)
-      self.readGeometry()
+      self.readGeometry(fastRead=fastRead)
       
   
-  def readGeometry(self):
+  def readGeometry(self, fastRead=False):
     """
     get dictionary object describing neuron model geometry info by reading file
+    if fastRead is True, tokenize the file in bulk into self.hocArrays and
+      only build Node/Compartment objects when they are first needed
+    """
+    with _pausedGarbageCollection():
+      if fastRead:
+        self._readGeometryBulk()
+      else:
+        self._readGeometryLines()
+  
+  
+  def _readGeometryLines(self):
+    """
+    Read the geometry file line by line, building objects as they are read
     """
-     
     lineNum = 0
     with open(self.fileName, 'r') as fIn:
       # read the geometry file
@@ -58,6 +144,9 @@ class HocGeometry(Geometry):
       raise IOError('Error reading %s, filament %s open at end of file' %
                     (self.fileName, self._openFilament))
     
+    # compute compartment geometry and totals in one pass
+    self._computeCompartmentGeometry(self.compartments)
+    
     # connect filaments and remove filaments and _connections, leaving segments
     # and nodes
     self._connectFilaments()
@@ -66,7 +155,233 @@ class HocGeometry(Geometry):
     # make compartments from hemispheres remaining at the end of unconnected
     # segments
     #self._addOneNodeCompartments()
+  
+  
+  def _readGeometryBulk(self):
+    """
+    Read the geometry file, tokenizing each filament declaration block in bulk.
+    Sets self.hocArrays, a dict of numpy arrays:
+      'x', 'y', 'z', 'd': coordinates and diameter of every pt3dadd point,
+        with the points of each filament stored contiguously
+      'filamentStarts', 'filamentCounts': index of first point and number of
+        points for each filament
+      'compartmentNodes': (numCompartments, 2) point indices of each
+        two-node compartment
+      'compartmentLengths': length of each compartment
+      'connectFilaments', 'connectLocations': (numConnections, 2) filament
+        indices and locations of each connect statement
+    Geometry totals (surfaceArea, volume, tags) are computed from the arrays;
+    the Node, Compartment and connection objects are built lazily.
+    """
+    with open(self.fileName, 'r') as fIn:
+      text = fIn.read()
+    
+    # dict from filamentIndex to list of (numPoints, 4) arrays, with
+    # filaments in the order they are declared in the file
+    chunks = {}
+    pos, lineNum, textLen = 0, 0, len(text)
+    while pos < textLen:
+      end = text.find('\n', pos)
+      if end < 0:
+        end = textLen
+      line = text[pos:end]
+      pos = end + 1
+      lineNum += 1
+      self._parseHocGeometryLine(line)
+      if not self._openFilament:
+        continue
+      
+      # read the whole declaration block at once
+      blockEnd = _hocBlockEndRe.search(text, pos)
+      if blockEnd is None:
+        break
+      body = text[pos:blockEnd.start()]
+      try:
+        self._parseFilamentBlock(body, chunks)
+      except (IOError, ValueError) as err:
+        sys.tracebacklimit = 0
+        raise type(err)('Error reading %s block starting at line %d: %s'
+                        % (self.fileName, lineNum, err))
+      lineNum += body.count('\n') + 1
+      pos = blockEnd.end() + 1
+      self._openFilament = None
+    
+    if self._openFilament:
+      raise IOError('Error reading %s, filament %s open at end of file' %
+                    (self.fileName, self._openFilament))
+    
+    # gather the points of each filament together, keeping filaments in the
+    # order they were declared in the file
+    numFilaments = len(self._filamentNames)
+    filamentStarts = np.zeros(numFilaments, dtype=int)
+    filamentCounts = np.zeros(numFilaments, dtype=int)
+    allPoints = []
+    numPoints = 0
+    for filamentIndex, pointList in chunks.items():
+      if not pointList:
+        continue
+      points = np.concatenate(pointList)
+      filamentStarts[filamentIndex] = numPoints
+      filamentCounts[filamentIndex] = len(points)
+      numPoints += len(points)
+      allPoints.append(points)
+    if allPoints:
+      allPoints = np.concatenate(allPoints)
+    else:
+      allPoints = np.zeros((0, 4))
+    x, y, z, d = (allPoints[:, n].copy() for n in range(4))
+    
+    # compartments join consecutive points in the same filament
+    pointFilament = np.repeat(np.arange(numFilaments), filamentCounts)
+    ind0 = np.nonzero(pointFilament[:-1] == pointFilament[1:])[0]
+    ind1 = ind0 + 1
+    r = 0.5 * d
+    lengths, areas, volumes, centroids = frustumGeometry(
+      x[ind0], y[ind0], z[ind0], r[ind0], x[ind1], y[ind1], z[ind1], r[ind1])
+    numDisks = np.count_nonzero((lengths == 0) & (r[ind0] != r[ind1]))
+    if numDisks:
+      warn('Compartment with zero length', '%d compartments' % numDisks)
+    
+    # update geometry totals and tag counts
+    self.surfaceArea += float(areas.sum())
+    self.volume += float(volumes.sum())
+    self.tags['*'] += len(ind0)
+    filamentCompartments = np.bincount(pointFilament[ind0],
+                                       minlength=numFilaments)
+    for filamentIndex, numComps in enumerate(filamentCompartments.tolist()):
+      if numComps:
+        self.tags[self._filaments[filamentIndex].name] += numComps
+    
+    filamentIndices = self._filamentIndices
+    connectFilaments = np.array(
+      [(filamentIndices[c['filament1']], filamentIndices[c['filament2']])
+       for c in self._connections], dtype=int).reshape(-1, 2)
+    connectLocations = np.array(
+      [(c['location1'], c['location2']) for c in self._connections],
+      dtype=float).reshape(-1, 2)
+    
+    self.hocArrays = {
+      'x' : x, 'y' : y, 'z' : z, 'd' : d,
+      'filamentStarts' : filamentStarts,
+      'filamentCounts' : filamentCounts,
+      'compartmentNodes' : np.column_stack((ind0, ind1)),
+      'compartmentLengths' : lengths,
+      'compartmentAreas' : areas,
+      'compartmentVolumes' : volumes,
+      'compartmentCentroids' : centroids,
+      'connectFilaments' : connectFilaments,
+      'connectLocations' : connectLocations
+    }
+    self._buildPending = True
+  
+  
+  def _parseFilamentBlock(self, body, chunks):
+    """
+    Parse the body of a filament declaration block in bulk, appending a
+    (numPoints, 4) array of x, y, z, d to chunks[filamentIndex]
+    """
+    filamentIndex = self._filamentIndices[self._openFilament]
+    
+    clears = list(_pt3dclearRe.finditer(body))
+    adds = _pt3daddRe.findall(body)
+    if len(_nonBlankLineRe.findall(body)) != len(clears) + len(adds):
+      raise IOError('Invalid filament command')
+    if clears:
+      # pt3dclear removes all the points previously added to the filament
+      chunks[filamentIndex] = []
+      adds = _pt3daddRe.findall(body, clears[-1].end())
+    if not adds:
+      return
+    
+    fields = ','.join(adds).split(',')
+    if len(fields) != 4 * len(adds):
+      # some points are of the form pt3dadd(x, y, z, d, 0)
+      fields = []
+      for add in adds:
+        addFields = add.split(',')
+        if len(addFields) == 5 and addFields[-1].strip() == '0':
+          addFields.pop()
+        elif len(addFields) != 4:
+          raise IOError('Unexpected form for pt3dadd')
+        fields.extend(addFields)
+    points = np.array(fields, dtype=float).reshape(-1, 4)
     
+    minD = points[:, 3].min()
+    if minD <= 0:
+      if minD == 0:
+        raise ValueError('pt3dadd with diameter = 0.0')
+      else:
+        raise ValueError('pt3dadd with diameter < 0.0')
+    chunks.setdefault(filamentIndex, []).append(points)
+  
+  
+  def _buildPendingObjects(self):
+    """
+    Create the Node, Compartment and Segment objects whose creation was
+    deferred by a fastRead or by fromGeometryArrays()
+    """
+    self._buildPending = False
+    fromGeometryArrays = self._geometryArrays is not None
+    with _pausedGarbageCollection():
+      if fromGeometryArrays:
+        self._buildFromGeometryArrays(self._geometryArrays)
+        self._geometryArrays = None
+      else:
+        self._buildObjects(self.hocArrays)
+        self._connectFilaments()
+    self._topologyChanged()
+    if fromGeometryArrays:
+      # the stored geometry was already checked, with disconnected parts
+      # removed
+      self._setConnectivityChecked(
+        self._connectivityKey(self._segments, True), [set(self._segments)])
+  
+  
+  def _buildObjects(self, arrays):
+    """
+    Create the Node and TwoNodeCompartment objects described by arrays (in
+    the format of self.hocArrays), adding them to their filament's segment
+    """
+    x, y, z = arrays['x'].tolist(), arrays['y'].tolist(), arrays['z'].tolist()
+    r = (0.5 * arrays['d']).tolist()
+    starts = arrays['filamentStarts'].tolist()
+    counts = arrays['filamentCounts'].tolist()
+    
+    numOldCompartments = len(self._compartments)
+    for start, count, filamentIndex in sorted(zip(starts, counts,
+                                                  range(len(starts)))):
+      if not count:
+        continue
+      segment = self._filaments[filamentIndex]
+      tags = {t for t in segment.tags}
+      tags.add(segment.name)
+      
+      nodes = [Node(x[n], y[n], z[n], r[n]) for n in range(start, start+count)]
+      for node in nodes:
+        node.segments.append(segment)
+        node.tags.update(tags)
+      
+      compartments = []
+      for node0, node1 in zip(nodes[:-1], nodes[1:]):
+        comp = TwoNodeCompartment(node0, node1)
+        node0.compartments.append(comp)
+        node1.compartments.append(comp)
+        comp.tags.update(tags)
+        comp.segment = segment
+        compartments.append(comp)
+      
+      segment.nodes.extend(nodes)
+      segment.compartments.extend(compartments)
+      segment._clearAggregates()
+      self._nodes.extend(nodes)
+      self._compartments.extend(compartments)
+    
+    # the compartment geometry was already computed by _readGeometryBulk()
+    setCompartmentGeometry(self._compartments[numOldCompartments:],
+                           arrays['compartmentLengths'],
+                           arrays['compartmentAreas'],
+                           arrays['compartmentVolumes'],
+                           arrays['compartmentCentroids'])
 
   def getSomaIndex(self):
     """
@@ -244,9 +559,9 @@ class HocGeometry(Geometry):
           'range should be of form "range minX maxX minY maxY minZ maxZ"')
       self.minRange = tuple([float(x) for x in splitLine[1:6:2]])
       self.maxRange = tuple([float(x) for x in splitLine[2:7:2]])
-    elif splitLine[0] in self._filamentNames:
+    elif splitLine[0] in self._filamentIndices:
       self._openFilament = splitLine[0]
-    elif splitLine[0]+'[0]' in self._filamentNames:
+    elif splitLine[0]+'[0]' in self._filamentIndices:
       self._openFilament = splitLine[0]+'[0]'
   
   def _parseDefineFilament(self, line):
@@ -258,7 +573,7 @@ class HocGeometry(Geometry):
     """
     splitLine = re.split(',|\)|\(', line.strip())
     
-    openSegment = self.segments[self._filamentNames.index(self._openFilament)]
+    openSegment = self._filaments[self._filamentIndices[self._openFilament]]
       
     if splitLine[0] == '}':
       self._openFilament = None
@@ -280,7 +595,8 @@ class HocGeometry(Geometry):
       if len(openSegment.nodes) > 1:
         node0 = openSegment.nodes[-2]
         node1 = openSegment.nodes[-1]
-        self._addCompartment(openSegment, node0, node1, append=True)
+        self._addCompartment(openSegment, node0, node1, append=True,
+                             computeGeometry=False)
     else:
       raise IOError('Invalid filament command')
 
@@ -333,10 +649,11 @@ class HocGeometry(Geometry):
         name = '%s[%d]' % (baseName, n)
       else:
         name = baseName
-      if name in self._filamentNames:
+      if name in self._filamentIndices:
         raise IOError('%s already created' % name)
       newSeg = self._addSegment(name)
       newSeg.filamentIndex = len(self._filamentNames)
+      self._filamentIndices[name] = newSeg.filamentIndex
       self._filamentNames.append(name)
       self._filaments[newSeg.filamentIndex] = newSeg
 
@@ -348,7 +665,7 @@ class HocGeometry(Geometry):
       their ends. Note that this removes a node for each connection
     """
     def _getSegmentFromFilament(_filament):
-      _segment = self._filaments[self._filamentNames.index(_filament)]
+      _segment = self._filaments[self._filamentIndices[_filament]]
       return _segment      
     
     while self._connections:
@@ -381,7 +698,195 @@ class HocGeometry(Geometry):
     """
     return a segment based upon filament number
     """
+    if self._buildPending:
+      self._buildPendingObjects()
     return self._filaments[index]
+  
+  
+  def getGeometryArrays(self):
+    """
+    Return a dict of numpy arrays describing the connected geometry: nodes,
+    compartments, segments, neighbors, and the hoc filaments and connections
+    they came from. The arrays can be saved with np.savez, and
+    HocGeometry.fromGeometryArrays() rebuilds an equivalent geometry from
+    them without reading or connecting the .hoc file.
+    NOTE: Only the geometry as loaded is stored. Derived information (soma,
+      axons, branches, branch orders) is recomputed after rebuilding.
+    """
+    nodeIndex = {node : n for n, node in enumerate(self.nodes)}
+    segIndex = {seg : n for n, seg in enumerate(self.segments)}
+    compIndex = {comp : n for n, comp in enumerate(self.compartments)}
+    
+    nodeCoords = np.array([(n.x, n.y, n.z, n.r1) for n in self.nodes],
+                          dtype=float).reshape(-1, 4)
+    compartmentNodes = np.array(
+      [(nodeIndex[c.nodes[0]], nodeIndex[c.nodes[-1]])
+       for c in self.compartments], dtype=int).reshape(-1, 2)
+    compartmentSegments = np.array(
+      [segIndex[c.segment] for c in self.compartments], dtype=int)
+    
+    segmentNodeOffsets, segmentNodes = _raggedArrays(
+      [[nodeIndex[n] for n in seg.nodes] for seg in self.segments])
+    segmentCompartmentOffsets, segmentCompartments = _raggedArrays(
+      [[compIndex[c] for c in seg.compartments] for seg in self.segments])
+    nodeSegmentOffsets, nodeSegments = _raggedArrays(
+      [[segIndex[s] for s in node.segments] for node in self.nodes])
+    nodeCompartmentOffsets, nodeCompartments = _raggedArrays(
+      [[compIndex[c] for c in node.compartments] for node in self.nodes])
+    
+    neighborOffsets, neighborSegments = _raggedArrays(
+      [[segIndex[n] for n in seg.neighbors] for seg in self.segments])
+    neighborLocations = np.array(
+      [(loc, nLoc) for seg in self.segments
+       for loc, nLoc, node in seg.neighborLocations],
+      dtype=float).reshape(-1, 2)
+    neighborNodes = np.array(
+      [nodeIndex[node] for seg in self.segments
+       for loc, nLoc, node in seg.neighborLocations], dtype=int)
+    
+    filamentIndices = self._filamentIndices
+    connectFilaments = np.array(
+      [(filamentIndices[c['filament1']], filamentIndices[c['filament2']])
+       for c in self.connections], dtype=int).reshape(-1, 2)
+    connectLocations = np.array(
+      [(c['location1'], c['location2']) for c in self.connections],
+      dtype=float).reshape(-1, 2)
+    
+    return {
+      'name' : np.array(self.name or ''),
+      'minRange' : np.array(self.minRange, dtype=float),
+      'maxRange' : np.array(self.maxRange, dtype=float),
+      'surfaceArea' : np.array(self.surfaceArea),
+      'volume' : np.array(self.volume),
+      'tagNames' : np.array(list(self.tags.keys())),
+      'tagCounts' : np.array(list(self.tags.values()), dtype=int),
+      'filamentNames' : np.array(self._filamentNames, dtype=str),
+      'filamentNameType' : np.array(self._filamentNameType or ''),
+      'nodeCoords' : nodeCoords,
+      'compartmentNodes' : compartmentNodes,
+      'compartmentSegments' : compartmentSegments,
+      'segmentFilaments' : np.array([s.filamentIndex for s in self.segments],
+                                    dtype=int),
+      'segmentNodeOffsets' : segmentNodeOffsets,
+      'segmentNodes' : segmentNodes,
+      'segmentCompartmentOffsets' : segmentCompartmentOffsets,
+      'segmentCompartments' : segmentCompartments,
+      'nodeSegmentOffsets' : nodeSegmentOffsets,
+      'nodeSegments' : nodeSegments,
+      'nodeCompartmentOffsets' : nodeCompartmentOffsets,
+      'nodeCompartments' : nodeCompartments,
+      'neighborOffsets' : neighborOffsets,
+      'neighbors' : neighborSegments,
+      'neighborLocations' : neighborLocations,
+      'neighborNodes' : neighborNodes,
+      'connectFilaments' : connectFilaments,
+      'connectLocations' : connectLocations
+    }
+  
+  
+  @classmethod
+  def fromGeometryArrays(cls, arrays, fileName=None, compact=False):
+    """
+    Return a HocGeometry rebuilt from arrays produced by getGeometryArrays().
+    The Node, Compartment and Segment objects are built when first accessed.
+    If compact is True, nodes and compartments are kept in a GeometryStore
+      (as NodeView and CompartmentView objects), which uses much less memory
+      but can't be reconnected
+    """
+    geometry = cls()
+    geometry._compact = compact
+    if fileName is not None:
+      geometry.setFileName(fileName)
+    
+    geometry.name = str(arrays['name']) or geometry.name
+    geometry.minRange = arrays['minRange'].tolist()
+    geometry.maxRange = arrays['maxRange'].tolist()
+    geometry.surfaceArea = float(arrays['surfaceArea'])
+    geometry.volume = float(arrays['volume'])
+    geometry.tags = dict(zip(arrays['tagNames'].tolist(),
+                             arrays['tagCounts'].tolist()))
+    geometry._filamentNames = arrays['filamentNames'].tolist()
+    geometry._filamentIndices = {name : n for n, name
+                                 in enumerate(geometry._filamentNames)}
+    geometry._filamentNameType = str(arrays['filamentNameType']) or None
+    
+    names = geometry._filamentNames
+    for (f1, f2), (loc1, loc2) in zip(arrays['connectFilaments'].tolist(),
+                                      arrays['connectLocations'].tolist()):
+      geometry.connections.append({
+        'filament1' : names[f1], 'location1' : loc1,
+        'filament2' : names[f2], 'location2' : loc2
+      })
+    
+    geometry._geometryArrays = arrays
+    geometry._buildPending = True
+    return geometry
+  
+  
+  def _buildFromGeometryArrays(self, arrays):
+    """
+    Create the Node, Compartment and Segment objects described by arrays (in
+    the format produced by getGeometryArrays())
+    """
+    def _ragged(name, objects):
+      # unpack (nameOffsets, names) arrays into lists of objects
+      offsets = arrays[name + 'Offsets'].tolist()
+      values = [objects[n] for n in arrays[name + 's'].tolist()]
+      return [values[offsets[n]:offsets[n+1]]
+              for n in range(len(offsets) - 1)]
+    
+    segments = []
+    for filamentIndex in arrays['segmentFilaments'].tolist():
+      segment = Segment(self)
+      segment.name = self._filamentNames[filamentIndex]
+      segment.filamentIndex = filamentIndex
+      self._filaments[filamentIndex] = segment
+      segments.append(segment)
+    
+    if self._compact:
+      self.store = GeometryStore(arrays, segments)
+      nodes = self.store.nodes
+      compartments = self.store.compartments
+    else:
+      nodes = [Node(x, y, z, r)
+               for x, y, z, r in arrays['nodeCoords'].tolist()]
+      compartments = [TwoNodeCompartment(nodes[n0], nodes[n1])
+                      for n0, n1 in arrays['compartmentNodes'].tolist()]
+      x, y, z, r = np.asarray(arrays['nodeCoords'], dtype=float).T
+      n0, n1 = np.asarray(arrays['compartmentNodes']).T
+      setCompartmentGeometry(compartments, *frustumGeometry(
+        x[n0], y[n0], z[n0], r[n0], x[n1], y[n1], z[n1], r[n1]))
+      for comp, segIndex in zip(compartments,
+                                arrays['compartmentSegments'].tolist()):
+        comp.segment = segments[segIndex]
+        comp.tags.add(comp.segment.name)
+      
+      for node, nodeSegs, nodeComps in zip(
+          nodes, _ragged('nodeSegment', segments),
+          _ragged('nodeCompartment', compartments)):
+        node.segments = nodeSegs
+        node.compartments = nodeComps
+        if nodeSegs:
+          node.tags.add(nodeSegs[0].name)
+    
+    neighborLocations = [(loc, nLoc, nodes[n]) for (loc, nLoc), n in
+                         zip(arrays['neighborLocations'].tolist(),
+                             arrays['neighborNodes'].tolist())]
+    neighborOffsets = arrays['neighborOffsets'].tolist()
+    for n, (segment, segNodes, segComps, segNeighbors) in enumerate(zip(
+        segments, _ragged('segmentNode', nodes),
+        _ragged('segmentCompartment', compartments),
+        _ragged('neighbor', segments))):
+      segment.nodes = segNodes
+      segment.compartments = segComps
+      segment.neighbors = segNeighbors
+      segment.neighborLocations = \
+        neighborLocations[neighborOffsets[n]:neighborOffsets[n+1]]
+    
+    self._nodes = nodes
+    self._segments = segments
+    self._compartments = compartments
+
       
 
 
@@ -448,7 +953,7 @@ def demoReadOld(geoFile):
     axonInds, axonTipPos = geometry.getAxonIndices()
     print('Axon tip length = %g' % axons[0].length)
     print('Axon tip pos = %f' % axonTipPos[0])
-    pDF = PathDistanceFinder(geometry, axons[0], axonTipPos[0])
+    pDF = geometry.getPathDistanceFinder(axons[0], axonTipPos[0])
     soma = geometry.soma
     somaInd, somaPos = geometry.getSomaIndex()
     print('Path distance from Axon tip to Soma = %g' %
@@ -472,7 +977,7 @@ def demoReadOld(geoFile):
     from math import sqrt, log
     from matplotlib import pyplot
 
-    pDF = PathDistanceFinder(geometry, somaInd)
+    pDF = geometry.getPathDistanceFinder(somaInd)
     dSeg = [pDF.distanceTo(s) for s in geometry.segments]
     with open('steady_voltages.pickle', 'r') as fIn:
       vSteady = cPickle.loads(fIn.read())
@@ -516,11 +1021,10 @@ def demoRead(geoFile):
   geometry = HocGeometry(geoFile)
   
   tips, tipPositions = geometry.getTips()
-  pDF = PathDistanceFinder(geometry, geometry.soma)
+  pDF = geometry.getPathDistanceFinder(geometry.soma)
   #tortuosities = [geometry.pathTortuosity(pDF.pathTo(tip, pos))
   #                for tip, pos in zip(tips, tipPositions)]
-  tortuosities = [pDF.tortuosityTo(tip, pos)
-                  for tip, pos in zip(tips, tipPositions)]
+  tortuosities = pDF.tortuositiesTo(tips, tipPositions)
   meanTort, stdTort = mean(tortuosities), std(tortuosities)
   
   print('From soma to tips, tortuosity is %.1f +- %.1f'
@@ -549,16 +1053,37 @@ def demoRead(geoFile):
 
 
 
-def demoReadsilent(geoFile):
+def findHocFiles(paths):
+  """
+  return sorted list of .hoc files in paths (files and/or directories)
+  """
+  hocFiles = []
+  for path in paths:
+    if os.path.isdir(path):
+      hocFiles.extend(sorted(os.path.join(path, f) for f in os.listdir(path)
+                             if f.lower().endswith('.hoc')))
+    else:
+      hocFiles.append(path)
+  return hocFiles
+
+
+
+def demoReadsilent(geoFile, fastRead=True, cache=None):
   ### Read in geometry file and pre-compute various quantities
-  geometry = HocGeometry(geoFile)
+  # cache may be a GeometryCache, or True to use the default on-disk cache
+  if cache is None or cache is False:
+    geometry = HocGeometry(geoFile, fastRead=fastRead)
+  else:
+    if cache is True:
+      from neuron_geometryCache import getDefaultCache
+      cache = getDefaultCache()
+    geometry = cache.load(geoFile, fastRead=fastRead)
   
   tips, tipPositions = geometry.getTips()
-  pDF = PathDistanceFinder(geometry, geometry.soma)
+  pDF = geometry.getPathDistanceFinder(geometry.soma)
   #tortuosities = [geometry.pathTortuosity(pDF.pathTo(tip, pos))
   #                for tip, pos in zip(tips, tipPositions)]
-  tortuosities = [pDF.tortuosityTo(tip, pos)
-                  for tip, pos in zip(tips, tipPositions)]
+  tortuosities = pDF.tortuositiesTo(tips, tipPositions)
   meanTort, stdTort = mean(tortuosities), std(tortuosities)
   
   print('From soma to tips, tortuosity is %.1f +- %.1f'
@@ -0,0 +1,257 @@
+#!/usr/bin/python
+
+
+
+_usageStr=\
+"""usage: neuron_rendering.py [-j numWorkers] [-f format] outDir hocFileOrDir
+                            [hocFileOrDir ...]
+  render a path length heatmap of every .hoc file, without a display, saving
+  outDir/<neuron>.<format> and a manifest of timings and failures in
+  outDir/manifest.json. <neuron> is the file name of the .hoc file without
+  its extension, numbered if another input already has that name
+  -j numWorkers  number of worker processes (default: number of CPUs)
+  -f format      image format, png or svg; may be repeated (default: png)
+"""
+
+
+
+import os, sys, json, time, traceback, multiprocessing
+import numpy as np
+import matplotlib
+from matplotlib import cm
+from matplotlib.collections import LineCollection
+from neuron_readExportedGeometry import *
+
+
+
+def pathOrder(pdists):
+  """
+  return array of indices to pdists, ordered from longest path to shortest.
+  Ties go to the earliest index, so reversing the order (shortest to longest)
+  puts the earliest of tied paths last.
+  """
+  return np.argsort(-np.asarray(pdists, dtype=float), kind='stable')
+
+
+def lineCollection(segments, colors, alpha=None):
+  # LineCollection that looks like the equivalent ax.plot lines
+  rcParams = matplotlib.rcParams
+  return LineCollection(segments, colors=colors, alpha=alpha,
+                        linewidths=rcParams['lines.linewidth'],
+                        capstyle=rcParams['lines.solid_capstyle'],
+                        joinstyle=rcParams['lines.solid_joinstyle'],
+                        zorder=2)
+
+
+def drawHeatmap(ax, geometry, vmax=None):
+  """
+  Draw the skeleton of geometry on 2D axes ax, overlaid with the paths from
+  the soma to each tip colored by path length (0 to vmax, default the longest
+  path).
+  return the (hidden) scatter to build a colorbar from
+  """
+  # Find the tip segments and their end locations
+  tips, ends = geometry.getTips()
+
+  # Calculate the path distance to, and the coordinates of, each tip
+  pDF = geometry.getPathDistanceFinder(geometry.soma)
+  pdists = pDF.distancesTo(tips)
+  coords = pDF.coordsAt(tips, ends)
+
+  # Plot the neuron skeleton (includes axons) as one collection of (N,2,2)
+  # node-pair segments
+  bpts = [np.array([[n.x, n.y] for n in b.nodes]).reshape(-1, 2)
+          for b in geometry.branches]
+  bsegs = np.concatenate([np.stack((b[:-1], b[1:]), axis=1) for b in bpts])
+  ax.add_collection(lineCollection(bsegs, 'k', alpha=0.5))
+
+  # Set up the path distance colormap with normalized values
+  if vmax is None:
+    vmax = max(pdists)
+  tfloats = [float(i)/vmax for i in pdists]
+  cmap = cm.viridis
+  tcolors = cmap(tfloats)
+
+  # Plot and color points at tips by path distance, as one collection that
+  # looks like the equivalent ax.plot markers (ms=1)
+  ax.scatter(coords[:, 0], coords[:, 1], s=1, c=tcolors, alpha=0.1,
+             edgecolors='none', zorder=2)
+
+  # Plot point at the soma
+  ax.plot(geometry.soma.nodes[0].x, geometry.soma.nodes[0].y, 'o',
+          color='black', alpha=0.9, mec='none')
+
+  # Overlay a tip path skeleton colored by path distance (discludes axons).
+  # Each segment is drawn once, in the color of the longest tip path through
+  # it, from shortest path to longest so longer paths stay on top
+  pind = pathOrder(pdists)[::-1]
+  tipDists, tipInds = geometry.maxTipPathDistances(tips)
+  ranks = np.empty(len(pind), dtype=int)
+  ranks[pind] = np.arange(len(pind))
+  onPath = np.flatnonzero(tipInds >= 0)
+  onPath = onPath[np.argsort(ranks[tipInds[onPath]], kind='stable')]
+  if len(onPath):
+    segments = geometry.segments
+    psegs = np.array([[[segments[i].nodes[0].x, segments[i].nodes[0].y],
+                       [segments[i].nodes[1].x, segments[i].nodes[1].y]]
+                      for i in onPath]).reshape(-1, 2, 2)
+    ax.add_collection(lineCollection(psegs, tcolors[tipInds[onPath]],
+                                     alpha=1))
+  ax.autoscale_view()
+
+  return ax.scatter([0,0], [0,0], c=[0., 1.], s=0.1, vmin=0, vmax=vmax,
+                    cmap=cmap)
+
+
+def renderHeatmap(hocFile, outDir, formats=('png',), fs=20, vmax=None,
+                  cache=True, name=None):
+  """
+  Parse hocFile and save its path length heatmap as outDir/<name>.<format>
+  for each of formats, drawing on an Agg canvas (no display or pyplot state
+  needed). name defaults to the file name of hocFile without its extension,
+  and may include subdirectories of outDir.
+  return dict of timings (s) and the files written
+  """
+  if name is None:
+    name = os.path.splitext(os.path.basename(hocFile))[0]
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+  startTime = time.time()
+  geometry = demoReadsilent(hocFile, cache=cache)
+  parseTime = time.time()
+
+  fig = Figure(figsize=(20,20))
+  FigureCanvasAgg(fig)
+  ax = fig.add_subplot(111)
+  sc = drawHeatmap(ax, geometry, vmax)
+  cbar = fig.colorbar(sc, ax=ax)
+  ax.set_xlabel('Micrometers', fontsize=fs)
+  ax.set_ylabel('Micrometers', fontsize=fs)
+  ax.set_title(os.path.basename(name) + ' Heatmap Colored by Path Length',
+               fontsize=fs)
+  cbar.set_label("Path Length (um)", fontsize=fs)
+  ax.set_aspect('equal', 'datalim')
+  drawTime = time.time()
+
+  outFiles = []
+  outBase = os.path.join(outDir, name)
+  os.makedirs(os.path.dirname(outBase), exist_ok=True)
+  for fmt in formats:
+    outFile = outBase + '.' + fmt
+    fig.savefig(outFile, format=fmt, bbox_inches='tight')
+    outFiles.append(outFile)
+  saveTime = time.time()
+
+  return {'outFiles' : outFiles, 'parseTime' : parseTime - startTime,
+          'drawTime' : drawTime - parseTime, 'saveTime' : saveTime - drawTime,
+          'totalTime' : saveTime - startTime}
+
+
+def _renderJob(args):
+  # render one heatmap in a worker, reporting failure instead of raising
+  hocFile, outDir, kwargs = args
+  entry = {'hocFile' : hocFile, 'outFiles' : []}
+  startTime = time.time()
+  try:
+    entry.update(renderHeatmap(hocFile, outDir, **kwargs))
+  except Exception as err:
+    entry['error'] = '%s: %s' % (type(err).__name__, err)
+    entry['traceback'] = traceback.format_exc()
+    entry['totalTime'] = time.time() - startTime
+  return entry
+
+
+def _outputNames(paths):
+  # return list of (hocFile, name) for the .hoc files in paths, naming each
+  #  by its file name (its path relative to the directory given, or to its
+  #  own directory) without extension, with a numbered suffix if that is
+  #  already taken (e.g. the same file listed twice)
+  names, used = [], set()
+  for hocFile in findHocFiles(paths):
+    base = os.path.splitext(os.path.basename(hocFile))[0]
+    name, n = base, 1
+    while name in used:
+      n += 1
+      name = '%s-%d' % (base, n)
+    used.add(name)
+    names.append((hocFile, name))
+  return names
+
+
+def renderBatch(paths, outDir, numWorkers=None, formats=('png',),
+                manifestName='manifest.json', **kwargs):
+  """
+  Render heatmaps of every .hoc file in paths (files and/or directories) into
+  outDir, named by their file names (see _outputNames), using numWorkers
+  processes (default: number of CPUs) that each parse, compute and render a
+  neuron independently. Other keyword arguments are passed to renderHeatmap.
+  Write a JSON manifest of timings and failures to outDir/manifestName, and
+  return it as a dict
+  """
+  if not os.path.isdir(outDir):
+    os.makedirs(outDir)
+  if numWorkers is None:
+    numWorkers = multiprocessing.cpu_count()
+  kwargs['formats'] = tuple(formats)
+  jobs = [(hocFile, outDir, dict(kwargs, name=name))
+          for hocFile, name in _outputNames(paths)]
+
+  startTime = time.time()
+  if numWorkers <= 1:
+    entries = [_renderJob(job) for job in jobs]
+  else:
+    pool = multiprocessing.Pool(min(numWorkers, max(len(jobs), 1)))
+    try:
+      entries = pool.map(_renderJob, jobs, chunksize=1)
+    finally:
+      pool.close()
+      pool.join()
+
+  failed = [entry['hocFile'] for entry in entries if 'error' in entry]
+  manifest = {'outDir' : os.path.abspath(outDir), 'numWorkers' : numWorkers,
+              'formats' : list(formats), 'numNeurons' : len(entries),
+              'numFailed' : len(failed), 'failed' : failed,
+              'totalTime' : time.time() - startTime, 'neurons' : entries}
+  with open(os.path.join(outDir, manifestName), 'w') as fOut:
+    json.dump(manifest, fOut, indent=1)
+  return manifest
+
+
+
+def _parseArguments():
+  arguments = sys.argv[1:]
+  numWorkers, formats = None, []
+  try:
+    while arguments and arguments[0] in ('-j', '-f'):
+      option, value = arguments[:2]
+      arguments = arguments[2:]
+      if option == '-j':
+        numWorkers = int(value)
+      elif value in ('png', 'svg'):
+        formats.append(value)
+      else:
+        raise ValueError('Unknown format: %s' % value)
+  except ValueError:
+    print(_usageStr)
+    raise TypeError('Incorrect arguments.')
+
+  if len(arguments) < 2:
+    print(_usageStr)
+    raise TypeError('Incorrect arguments.')
+
+  return numWorkers, formats or ['png'], arguments[0], arguments[1:]
+
+
+
+###############################################################################
+if __name__ == "__main__":
+  numWorkers, formats, outDir, paths = _parseArguments()
+  manifest = renderBatch(paths, outDir, numWorkers=numWorkers,
+                         formats=formats)
+  print('Rendered %d of %d neurons into %s in %.1f s'
+        % (manifest['numNeurons'] - manifest['numFailed'],
+           manifest['numNeurons'], outDir, manifest['totalTime']))
+  for hocFile in manifest['failed']:
+    print('  failed: %s' % hocFile)
+  sys.exit(1 if manifest['failed'] else 0)